@@ -0,0 +1,243 @@
+"""REST endpoints of the Flask server, for batch consumers of the valuation.
+
+GET /api/valuation?tickers=PETR4.SA,VALE3.SA&discount=0.2&margin=0.15
+    streams one NDJSON line per ticker as soon as it is valued, gzipped
+    incrementally when the client accepts it
+GET /api/fundamentals/<ticker>
+    report and warning flags of one ticker, gzipped by Flask-Compress
+
+Both answer with ETag and Last-Modified when every ticker is on the
+fundamentals cache, and 304 to a matching conditional request. The prices
+of a conditional valuation request are synced before its validators are
+computed, and Last-Modified covers the last bars written.
+"""
+import calendar
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import math
+import os
+import zlib
+
+import flask
+import numpy as np
+from cache import fundamentals_cache
+from metrics import registry
+from prices import price_store
+import utils
+
+
+API_MAX_TICKERS = int(os.environ.get('API_MAX_TICKERS', 500))
+
+# tickers valued at the same time across every streaming request
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('API_WORKERS', 4)))
+
+blueprint = flask.Blueprint('api', __name__, url_prefix='/api')
+
+
+def _Plain(value):
+    """JSON friendly copy of value: numpy scalars as python ones and nan
+    as null"""
+    if isinstance(value, dict):
+        return {key: _Plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_Plain(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _BadRequest(message):
+    return flask.make_response(flask.jsonify(error=message), 400)
+
+
+def _SyncPrices(ticker):
+    """SyncPrices of the ticker, False when the download failed"""
+    try:
+        utils.SyncPrices(ticker)
+    except Exception:
+        return False
+    return True
+
+
+def _IsConditional():
+    request = flask.request
+    return bool(request.if_none_match or request.if_modified_since)
+
+
+def Validators(tickers, *params, prices=True, sync=False):
+    """ETag and Last-Modified of the answer for the tickers, from the
+    fundamentals cache and the price archive
+
+    :param tickers: stock tickers
+    :type tickers: list
+    :param prices: the answer depends on the prices
+    :type prices: bool
+    :param sync: bring the prices up to date first, so a conditional
+        request is never answered 304 with stale ones
+    :type sync: bool
+    :return: etag and last modified timestamp, None when a ticker is not
+        cached so the answer is computed now
+    :rtype: tuple
+    """
+    stored = []
+    modified = []
+    for ticker in tickers:
+        info = fundamentals_cache.info(utils.FundamentalsCacheKey(ticker))
+        if info is None:
+            return None
+        stored.append([ticker, info['stored_at']])
+        modified.append(info['stored_at'])
+
+    if prices:
+        if sync and not all(executor.map(_SyncPrices, tickers)):
+            return None
+        for item in stored:
+            coverage = price_store.archive.coverage(item[0])
+            item.append([str(day) for day in coverage] if coverage else None)
+            # the bars written by the sync are newer than the report
+            modified.append(price_store.archive.updated_at(item[0]) or 0)
+
+    digest = hashlib.sha1(json.dumps([stored, params]).encode()).hexdigest()
+
+    return digest, max(modified)
+
+
+def _NotModified(validators):
+    """Whether the conditional request matches the validators"""
+    request = flask.request
+    if validators is None:
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains(validators[0])
+    return (request.if_modified_since is not None and
+            calendar.timegm(request.if_modified_since.utctimetuple()) >=
+            int(validators[1]))
+
+
+def _Conditional(response_factory, validators):
+    """Build the response, or a 304 without computing it
+
+    The check is done by hand because werkzeug's make_conditional would
+    buffer a streamed body to compute its length.
+    """
+    if _NotModified(validators):
+        response = flask.Response(status=304)
+    else:
+        response = response_factory()
+
+    if validators is not None:
+        response.set_etag(validators[0])
+        response.last_modified = validators[1]
+        response.cache_control.no_cache = True
+
+    return response
+
+
+@registry.timed('api_valuation_row')
+def ValuationRow(ticker, discount_rate, margin_rate):
+    """FuturePricing, GetFiancialReport and CheckWarningFlags of a ticker
+
+    :return: one line of the NDJSON stream
+    :rtype: dict
+    """
+    try:
+        fundamentals = utils.GetFiancialReport(ticker)
+        # the pricing only reads the archive, bring it up to date first
+        utils.SyncPrices(ticker)
+        return _Plain(dict(
+            ticker=ticker,
+            pricing=utils.FuturePricing(ticker, fundamentals, discount_rate,
+                                        margin_rate)[0],
+            fundamentals=fundamentals.to_dict('records'),
+            warnings=[item['reason'] for item in
+                      utils.CheckWarningFlags(fundamentals)]))
+    except Exception as error:
+        return dict(ticker=ticker, error=repr(error))
+
+
+def StreamRows(tickers, discount_rate, margin_rate, gzip=False):
+    """NDJSON lines of the tickers in completion order
+
+    :param gzip: gzip the stream, flushing after every line
+    :type gzip: bool
+    :return: generator of encoded lines
+    :rtype: generator
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    futures = [executor.submit(ValuationRow, ticker, discount_rate,
+                               margin_rate) for ticker in tickers]
+    try:
+        for future in as_completed(futures):
+            line = (json.dumps(future.result(), ensure_ascii=False) +
+                    '\n').encode('utf-8')
+            if gzip:
+                line = (compressor.compress(line) +
+                        compressor.flush(zlib.Z_SYNC_FLUSH))
+            yield line
+        if gzip:
+            yield compressor.flush()
+    finally:
+        # the client went away, give the workers back
+        for future in futures:
+            future.cancel()
+
+
+@blueprint.route('/valuation')
+def Valuation():
+    tickers = [ticker.strip() for ticker in
+               flask.request.args.get('tickers', '').split(',')
+               if ticker.strip()]
+    if not tickers:
+        return _BadRequest('tickers is required, e.g. ?tickers=PETR4.SA')
+    if len(tickers) > API_MAX_TICKERS:
+        return _BadRequest(f'at most {API_MAX_TICKERS} tickers per request')
+    try:
+        discount_rate = float(flask.request.args.get('discount', 0.2))
+        margin_rate = float(flask.request.args.get('margin', 0.15))
+    except ValueError:
+        return _BadRequest('discount and margin must be numbers')
+
+    # Flask-Compress would buffer the whole stream, it is gzipped here
+    gzip = 'gzip' in flask.request.headers.get('Accept-Encoding', '').lower()
+
+    def Stream():
+        response = flask.Response(
+            StreamRows(tickers, discount_rate, margin_rate, gzip=gzip),
+            mimetype='application/x-ndjson')
+        response.vary.add('Accept-Encoding')
+        if gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    # only a conditional request waits for the prices before the first
+    # line; otherwise the ETag is from the bars already on disk and each
+    # row syncs its ticker as it is valued
+    return _Conditional(Stream, Validators(tickers, discount_rate,
+                                           margin_rate, gzip,
+                                           sync=_IsConditional()))
+
+
+@blueprint.route('/fundamentals/<ticker>')
+def Fundamentals(ticker):
+    def Report():
+        fundamentals = utils.GetFiancialReport(ticker)
+        return flask.jsonify(_Plain(dict(
+            ticker=ticker,
+            fundamentals=fundamentals.to_dict('records'),
+            warnings=[item['reason']
+                      for item in utils.CheckWarningFlags(fundamentals)])))
+
+    validators = Validators([ticker], prices=False)
+    response = _Conditional(Report, validators)
+    if validators is None:
+        # just fetched, so the next request can already be conditional
+        validators = Validators([ticker], prices=False)
+        if validators is not None:
+            response.set_etag(validators[0])
+            response.last_modified = validators[1]
+
+    return response
@@ -1,13 +1,21 @@
 from datetime import datetime as dt
-from dateutil.relativedelta import relativedelta
+import math
+import os
 import numpy as np
+import api
 import dash
-from dash.dependencies import Input, Output
+from dateutil.relativedelta import relativedelta
+import flask
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
-import pandas_datareader as dr
+from dash_table.Format import Format, Group, Scheme
+from metrics import registry
+import ohlc
+import screener
 import utils
+import warmer
 
 
 ## Set up the app
@@ -16,10 +24,44 @@ external_stylesheets = ['https://github.com/plotly/dash-app-stylesheets/blob/mas
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
 
+# the dashboard components only exist while its page is displayed
+app.config.suppress_callback_exceptions = True
+
+
+def StartBackgroundThreads():
+    """Start the threads of a worker, once per process"""
+    # keep the tickers snapshot up to date without blocking the startup
+    utils.StartTickersRefresher()
+
+    # pre-fetch the most viewed tickers off-peak
+    if os.environ.get('WARMER_ENABLED', '1') != '0':
+        warmer.StartWarmer()
+
+
+# threads do not survive a fork, with gunicorn --preload they are started
+# by the post_fork hook of gunicorn.conf.py
+if os.environ.get('APP_PRELOADED') != '1':
+    StartBackgroundThreads()
+
 app.title = 'B3 Value Investing'
 
+
+# REST endpoints for batch consumers
+server.register_blueprint(api.blueprint)
+
+# Prometheus scrape endpoint, timings are per gunicorn worker
+@server.route('/metrics')
+def Metrics():
+    return flask.Response(registry.render(),
+                          mimetype='text/plain; version=0.0.4')
+
+# Number formats of the DataTable columns, the data stays numeric
+decimal_format = Format(precision=2, scheme=Scheme.fixed)
+thousands_format = Format(precision=2, scheme=Scheme.fixed, group=Group.yes)
+percentage_format = Format(precision=2, scheme=Scheme.percentage)
+
 # Set up the layout
-app.layout = html.Div([
+dashboard_layout = html.Div([
     html.Div([
         #dcc.Loading(id="loading-1", children=[html.Div(id='future-price-table')], type='circle'),
         html.H1('B3 Value Investing'),
@@ -27,28 +69,47 @@ app.layout = html.Div([
         html.H3('Escolha uma ação'),
         dcc.Dropdown(
             id='tickers-dropdown',
-            options=utils.GetTickers(),
+            options=utils.LoadTickers(),
             value='PETR4.SA'
         ),
-        html.H3('Gráfico de preço das ações em 5 anos'),
+        # reloads the dropdown options from the tickers snapshot
+        dcc.Interval(
+            id='tickers-interval',
+            interval=10 * 60 * 1000,
+        ),
+        html.H3('Gráfico de preço das ações'),
+        # months of history, the candle size follows the zoom
+        dcc.RadioItems(
+            id='range-selector',
+            options=[{'label': label, 'value': months}
+                     for label, months in [('6M', 6), ('1A', 12), ('2A', 24),
+                                           ('5A', 60), ('10A', 120),
+                                           ('20A', 240)]],
+            value=60,
+            labelStyle={'display': 'inline-block', 'margin-right': '10px'}
+        ),
         dcc.Graph(id='stock-graph'),
         html.P('')
     ], style={'width': '40%', 'display': 'inline-block'}),
     html.Div([
         html.H3('Variáveis Críticas e Índices'),
         html.H5('Valores em milhões de Reais.'),
+        # raw float64 report of the selected ticker, as column lists
+        dcc.Store(id='fundamentals-store'),
+        # ticker dependent inputs of the future price table
+        dcc.Store(id='pricing-store'),
         dash_table.DataTable(
             id='data-table',
             columns=[
                 {'id': 'Year', 'name': 'Ano', 'type': 'numeric',},
-                {'id': 'Diluted Normalized EPS', 'name': 'EPS Diluído Normalizado', 'type': 'numeric',},
-                {'id': 'EPS Growth', 'name': 'Crescimento do EPS', 'type': 'numeric', },
-                {'id': 'Net Income', 'name': 'Lucro Líquido', 'type': 'numeric', },
-                {'id': 'Shareholders Equity', 'name': 'Patrimônio Líquido', 'type': 'numeric',},
-                {'id': 'ROA', 'name': 'ROA', 'type': 'numeric',},
-                {'id': 'Total Long Term Debt', 'name': 'Dívida de Longo Prazo', 'type': 'numeric',},
-                {'id': 'ROE', 'name': 'ROE', 'type': 'numeric',},
-                {'id': 'EBIT', 'name': 'EBIT', 'type': 'numeric',},
+                {'id': 'Diluted Normalized EPS', 'name': 'EPS Diluído Normalizado', 'type': 'numeric', 'format': decimal_format,},
+                {'id': 'EPS Growth', 'name': 'Crescimento do EPS', 'type': 'numeric', 'format': percentage_format, },
+                {'id': 'Net Income', 'name': 'Lucro Líquido', 'type': 'numeric', 'format': thousands_format, },
+                {'id': 'Shareholders Equity', 'name': 'Patrimônio Líquido', 'type': 'numeric', 'format': thousands_format,},
+                {'id': 'ROA', 'name': 'ROA', 'type': 'numeric', 'format': decimal_format,},
+                {'id': 'Total Long Term Debt', 'name': 'Dívida de Longo Prazo', 'type': 'numeric', 'format': thousands_format,},
+                {'id': 'ROE', 'name': 'ROE', 'type': 'numeric', 'format': decimal_format,},
+                {'id': 'EBIT', 'name': 'EBIT', 'type': 'numeric', 'format': thousands_format,},
             ],
             # style table
             # style_table={
@@ -171,36 +232,128 @@ app.layout = html.Div([
 ])
 
 
+def ScreenerLayout():
+    """Ranking of the last screener run, read from disk on each visit"""
+    return html.Div([
+        html.H1('B3 Value Investing'),
+        html.H3('Screener do mercado'),
+        html.H5('Gerado com python screener.py, ordenado pela margem sobre o último valor da ação.'),
+        dash_table.DataTable(
+            id='screener-table',
+            columns=[
+                {'id': 'ticker', 'name': 'Ação', 'type': 'text', },
+                {'id': 'decision', 'name': 'Decisão', 'type': 'text', },
+                {'id': 'last_share_price', 'name': 'Últ Valor Ação', 'type': 'numeric', 'format': decimal_format, },
+                {'id': 'margin_price', 'name': 'Valor Marginal', 'type': 'numeric', 'format': decimal_format, },
+                {'id': 'margin_upside', 'name': 'Margem', 'type': 'numeric', 'format': percentage_format, },
+                {'id': 'roe_mean', 'name': 'ROE Médio', 'type': 'numeric', 'format': decimal_format, },
+                {'id': 'roa_mean', 'name': 'ROA Médio', 'type': 'numeric', 'format': decimal_format, },
+                {'id': 'alerts', 'name': 'Alertas', 'type': 'numeric', },
+                {'id': 'reasons', 'name': 'Razões', 'type': 'text', },
+            ],
+            data=screener.LoadRanking(),
+            sorting=True,
+            filtering=True,
+            style_cell={
+                'fontFamily': 'Open Sans',
+                'textAlign': 'left',
+                'height': '8px',
+                'padding': '1px 10px',
+                'whiteSpace': 'inherit',
+                'overflow': 'hidden',
+                'textOverflow': 'ellipsis',
+            },
+            # style header
+            style_header={
+                'fontWeight': 'bold',
+                'textAlign': 'left',
+                'backgroundColor': 'blue',
+                'color': 'white',
+            },
+            # style data
+            style_data_conditional=[
+                {
+                    # stripped rows
+                    'if': {'row_index': 'odd'},
+                    'backgroundColor': 'rgb(248, 248, 248)'
+                },
+            ],
+        ),
+    ])
+
+
+app.layout = html.Div([
+    dcc.Location(id='url', refresh=False),
+    html.Div([
+        dcc.Link('Dashboard', href='/'),
+        html.Span(' | '),
+        dcc.Link('Screener', href='/screener'),
+    ]),
+    html.Div(id='page-content'),
+])
+
+
 ## Set up the callbacks
 
+# Page routing callback
+@app.callback(
+    Output(component_id='page-content', component_property='children'),
+    [Input(component_id='url', component_property='pathname')]
+)
+def DisplayPage(pathname):
+    if pathname == '/screener':
+        return ScreenerLayout()
+    return dashboard_layout
+
+# Tickers dropdown callback
+@app.callback(
+    Output(component_id='tickers-dropdown', component_property='options'),
+    [Input(component_id='tickers-interval', component_property='n_intervals')]
+)
+def UpdateTickers(n_intervals):
+    return utils.LoadTickers()
+
 # Stock graph callback
 @app.callback(
     Output(component_id='stock-graph', component_property='figure'),
-    [Input(component_id='tickers-dropdown', component_property='value')]
+    [Input(component_id='tickers-dropdown', component_property='value'),
+     Input(component_id='range-selector', component_property='value'),
+     Input(component_id='stock-graph', component_property='relayoutData')]
 )
-def UpdateStockGraph(selected_dropdown_value):
-    selected_stock_df = dr.DataReader(
-        selected_dropdown_value,
-        data_source='yahoo',
-        start=(dt.now() - relativedelta(years=5)),
-        end=dt.now())
+@registry.timed('callback_UpdateStockGraph')
+def UpdateStockGraph(selected_dropdown_value, months=60, relayout_data=None):
+    prices = utils.GetPriceArrays(selected_dropdown_value,
+                                  years=max(1, math.ceil(months / 12)))
+
+    start = np.datetime64(dt.now().date() - relativedelta(months=months))
+    first = np.searchsorted(prices['date'], start)
+    prices = {column: values[first:] for column, values in prices.items()}
+
+    # a new ticker or range resets the zoom of the previous one
+    zoom = None
+    if relayout_data and flask.has_request_context():
+        triggered = [item['prop_id']
+                     for item in dash.callback_context.triggered]
+        if 'stock-graph.relayoutData' in triggered:
+            zoom = ohlc.ZoomRange(relayout_data)
+
+    trace, frequency = ohlc.CandlestickTrace(
+        prices, *(zoom or (None, None)))
 
     yAxisLabel = 'Valor da ação em BRL'
+    candle_labels = {'D': 'diário', 'W': 'semanal', 'M': 'mensal',
+                     'Y': 'anual'}
+
+    xaxis = {'title': 'Data (candle %s)' % candle_labels[frequency],
+             'rangeslider': {'visible': False}}
+    if zoom:
+        xaxis['range'] = [str(day) for day in zoom]
 
     return {
-        'data': [{
-            'open': selected_stock_df.Open,
-            'high': selected_stock_df.High,
-            'low': selected_stock_df.Low,
-            'close': selected_stock_df.Close,
-            'x': selected_stock_df.index,
-            'type': 'candlestick'
-        }],
+        'data': [trace],
         'layout': {
                 'title': selected_dropdown_value,
-                'xaxis': {
-                    'title': 'Data'
-                },
+                'xaxis': xaxis,
                 'yaxis': {
                     'title': yAxisLabel
                 }
@@ -209,33 +362,44 @@ def UpdateStockGraph(selected_dropdown_value):
 
 # Data table callback
 @app.callback(
-    Output(component_id='data-table', component_property='data'),
+    [Output(component_id='fundamentals-store', component_property='data'),
+     Output(component_id='data-table', component_property='data')],
     [Input(component_id='tickers-dropdown', component_property='value')]
 )
+@registry.timed('callback_UpdateTable')
 def UpdateTable(selected_dropdown_value):
+    warmer.RecordAccess(selected_dropdown_value)
     df = utils.GetFiancialReport(selected_dropdown_value)
-    return df.to_dict('records')
+    return df.to_dict('list'), df.to_dict('records')
 
 # Reason table callback
 @app.callback(
     Output(component_id='reason-list', component_property='data'),
-    [Input(component_id='data-table', component_property='data')]
+    [Input(component_id='fundamentals-store', component_property='data')]
 )
-def CreateReasonList(data_table):
-    return utils.CheckWarningFlags(data_table)
+@registry.timed('callback_CreateReasonList')
+def CreateReasonList(fundamentals):
+    return utils.CheckWarningFlags(fundamentals)
 
-# Reason table callback
+# Pricing inputs callback, ticker dependent part of the decision
 @app.callback(
+    Output(component_id='pricing-store', component_property='data'),
+    [Input(component_id='fundamentals-store', component_property='data')],
+    [State(component_id='tickers-dropdown', component_property='value')]
+)
+@registry.timed('callback_UpdatePricingInputs')
+def UpdatePricingInputs(fundamentals, ticker):
+    return utils.PricingInputs(ticker, fundamentals)
+
+# Future price table callback, runs on the browser (assets/valuation.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='valuation', function_name='futurePricing'),
     Output(component_id='future-price-table', component_property='data'),
-    [Input(component_id='tickers-dropdown', component_property='value'),
-     Input(component_id='data-table', component_property='data'),
+    [Input(component_id='pricing-store', component_property='data'),
      Input(component_id='discountrate-slider', component_property='value'),
      Input(component_id='marginrate-slider', component_property='value'),
      ]
 )
-def CreateDecision(ticker, data_table, discount_rate, margin_rate):
-    return utils.FuturePricing(ticker, data_table, discount_rate, margin_rate)
-
 
 if __name__ == '__main__':
     app.run_server(debug=True)
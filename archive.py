@@ -0,0 +1,363 @@
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Yahoo columns and the .npy file holding each one
+ARCHIVE_COLUMNS = {'Open': 'open',
+                   'High': 'high',
+                   'Low': 'low',
+                   'Close': 'close',
+                   'Adj Close': 'adj_close',
+                   'Volume': 'volume'}
+
+
+class PriceArchive(object):
+    """Columnar, memory-mapped archive of daily OHLCV bars.
+
+    Each ticker has a folder of segments, every segment holding one .npy
+    file per column plus the datetime64[D] dates, and a manifest.json naming
+    the live segments and the first day the archive covers. Reads memory-map
+    the files, so a single-segment ticker is sliced without copying; daily
+    updates append a new segment and compaction merges them back into one.
+    """
+
+    def __init__(self, directory, max_segments=8):
+        """
+        :param directory: root folder of the archive
+        :type directory: str
+        :param max_segments: segments a ticker may have before an append
+            compacts it
+        :type max_segments: int
+        """
+        self.directory = directory
+        self.max_segments = max_segments
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+
+    def _ticker_dir(self, ticker):
+        return os.path.join(self.directory, ticker)
+
+    def _manifest(self, ticker):
+        try:
+            with open(os.path.join(self._ticker_dir(ticker),
+                                   'manifest.json')) as manifest:
+                return json.load(manifest)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, ticker, manifest):
+        path = os.path.join(self._ticker_dir(ticker), 'manifest.json')
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_path, path)
+
+    @contextmanager
+    def _lock(self, ticker):
+        os.makedirs(self._ticker_dir(ticker), exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+
+        with open(os.path.join(self._ticker_dir(ticker), 'lock'),
+                  'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_segment(self, ticker, dates, columns):
+        with self._counter_lock:
+            self._counter += 1
+            name = 'seg-%s-%d-%d' % (np.datetime_as_string(dates[0]),
+                                     os.getpid(), self._counter)
+
+        path = os.path.join(self._ticker_dir(ticker), name)
+        temp_path = path + '.tmp'
+        os.makedirs(temp_path)
+        np.save(os.path.join(temp_path, 'date.npy'), dates)
+        for column, values in columns.items():
+            np.save(os.path.join(temp_path, column + '.npy'), values)
+        os.rename(temp_path, path)
+
+        return name
+
+    def _remove_unreferenced(self, ticker, manifest):
+        live = set(manifest['segments'])
+        for name in os.listdir(self._ticker_dir(ticker)):
+            if name.startswith('seg-') and name not in live:
+                # readers keep their memory maps of removed files
+                shutil.rmtree(os.path.join(self._ticker_dir(ticker), name),
+                              ignore_errors=True)
+
+    def _load(self, ticker, manifest, columns):
+        segments = []
+        for name in manifest['segments']:
+            path = os.path.join(self._ticker_dir(ticker), name)
+            segments.append({column: np.load(os.path.join(path,
+                                                          column + '.npy'),
+                                             mmap_mode='r')
+                             for column in ['date'] + columns})
+
+        if not segments:
+            return None
+        if len(segments) == 1:
+            return segments[0]
+
+        return {column: np.concatenate([segment[column]
+                                        for segment in segments])
+                for column in segments[0]}
+
+    def coverage(self, ticker):
+        """First and last archived days of the ticker
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :return: (start, last day) as datetime64[D], None when unknown
+        :rtype: tuple
+        """
+        manifest = self._manifest(ticker)
+        if manifest is None:
+            return None
+
+        last = manifest.get('last')
+        return (np.datetime64(manifest['start'], 'D'),
+                np.datetime64(last, 'D') if last else None)
+
+    def read(self, ticker, start=None, end=None, columns=None):
+        """Bars of the ticker between start and end, both inclusive
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param start: first day, None for the whole archive
+        :type start: numpy.datetime64
+        :param end: last day, None for the whole archive
+        :type end: numpy.datetime64
+        :param columns: archive column names, defaults to all of them
+        :type columns: list
+        :return: 'date' plus one array per column, memory mapped views
+            when the ticker has a single segment; None when not archived
+        :rtype: dict
+        """
+        columns = list(columns or ARCHIVE_COLUMNS.values())
+
+        for attempt in range(3):
+            manifest = self._manifest(ticker)
+            if manifest is None:
+                return None
+            try:
+                arrays = self._load(ticker, manifest, columns)
+                break
+            except (OSError, ValueError):
+                # a compaction removed the segments, read the new manifest
+                if attempt == 2:
+                    raise
+                time.sleep(0.01)
+
+        if arrays is None:
+            return {column: np.empty(0, dtype='datetime64[D]' if
+                                     column == 'date' else float)
+                    for column in ['date'] + columns}
+
+        dates = arrays['date']
+        first = 0 if start is None else np.searchsorted(
+            dates, np.datetime64(start, 'D'), side='left')
+        last = len(dates) if end is None else np.searchsorted(
+            dates, np.datetime64(end, 'D'), side='right')
+
+        return {column: values[first:last]
+                for column, values in arrays.items()}
+
+    def append(self, ticker, dates, columns, start=None):
+        """Append the bars newer than the last archived day
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param dates: days of the bars, ascending
+        :type dates: numpy array of datetime64[D]
+        :param columns: values of each archive column
+        :type columns: dict
+        :param start: first day the archive covers, for a new ticker
+        :type start: numpy.datetime64
+        :return: number of bars appended
+        :rtype: int
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+
+        with self._lock(ticker):
+            manifest = self._manifest(ticker) or dict(
+                start=str(np.datetime64(start if start is not None else
+                                        dates[0], 'D')),
+                last=None,
+                segments=[])
+
+            if manifest['last'] is not None:
+                new = dates > np.datetime64(manifest['last'], 'D')
+                dates = dates[new]
+                columns = {column: np.asarray(values)[new]
+                           for column, values in columns.items()}
+
+            if len(dates):
+                manifest['segments'].append(self._write_segment(
+                    ticker, dates, self._typed(columns)))
+                manifest['last'] = str(dates[-1])
+                manifest['updated_at'] = time.time()
+
+            self._write_manifest(ticker, manifest)
+
+            if len(manifest['segments']) > self.max_segments:
+                self._compact(ticker, manifest)
+
+        return len(dates)
+
+    def rewrite(self, ticker, dates, columns, start):
+        """Replace the whole archive of the ticker, used to backfill days
+        older than the covered start
+
+        :param start: first day the archive covers
+        :type start: numpy.datetime64
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+
+        with self._lock(ticker):
+            previous = self._manifest(ticker) or {}
+            manifest = dict(start=str(np.datetime64(start, 'D')),
+                            last=str(dates[-1]) if len(dates) else None,
+                            segments=[],
+                            updated_at=time.time())
+            if 'synced_at' in previous:
+                manifest['synced_at'] = previous['synced_at']
+            if len(dates):
+                manifest['segments'].append(self._write_segment(
+                    ticker, dates, self._typed(columns)))
+
+            self._write_manifest(ticker, manifest)
+            self._remove_unreferenced(ticker, manifest)
+
+    def synced_at(self, ticker):
+        """Last time the ticker was checked for new bars, by any worker
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :return: timestamp, None when never checked
+        :rtype: float
+        """
+        manifest = self._manifest(ticker)
+        return None if manifest is None else manifest.get('synced_at')
+
+    def updated_at(self, ticker):
+        """Last time bars of the ticker were written, by any worker
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :return: timestamp, None when unknown
+        :rtype: float
+        """
+        manifest = self._manifest(ticker)
+        return None if manifest is None else manifest.get('updated_at')
+
+    def mark_synced(self, ticker, timestamp=None):
+        """Record on the manifest that the ticker was checked for new bars
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param timestamp: time of the check, defaults to now
+        :type timestamp: float
+        """
+        with self._lock(ticker):
+            manifest = self._manifest(ticker)
+            if manifest is not None:
+                manifest['synced_at'] = (time.time() if timestamp is None
+                                         else timestamp)
+                self._write_manifest(ticker, manifest)
+
+    def remove(self, ticker):
+        """Drop every archived bar of the ticker"""
+        with self._lock(ticker):
+            shutil.rmtree(self._ticker_dir(ticker), ignore_errors=True)
+
+    def compact(self, ticker):
+        """Merge the segments of the ticker into a single one, so reads are
+        zero-copy again"""
+        with self._lock(ticker):
+            manifest = self._manifest(ticker)
+            if manifest is not None and len(manifest['segments']) > 1:
+                self._compact(ticker, manifest)
+
+    def _compact(self, ticker, manifest):
+        arrays = self._load(ticker, manifest,
+                            list(ARCHIVE_COLUMNS.values()))
+        dates = arrays.pop('date')
+        manifest = dict(manifest,
+                        segments=[self._write_segment(ticker, dates,
+                                                      arrays)])
+        self._write_manifest(ticker, manifest)
+        self._remove_unreferenced(ticker, manifest)
+
+    def _typed(self, columns):
+        return {column: np.asarray(columns[column], dtype=float)
+                for column in ARCHIVE_COLUMNS.values()}
+
+    def tickers(self):
+        """Every archived ticker
+
+        :rtype: list
+        """
+        try:
+            return sorted(name for name in os.listdir(self.directory)
+                          if self._manifest(name) is not None)
+        except OSError:
+            return []
+
+    def panel(self, tickers, column='close', start=None, end=None):
+        """One column of many tickers aligned on the union of their days
+
+        :param tickers: stock tickers
+        :type tickers: list
+        :param column: archive column name
+        :type column: str
+        :return: days and a (tickers, days) matrix, nan where a ticker has
+            no bar
+        :rtype: tuple
+        """
+        series = [self.read(ticker, start, end, columns=[column])
+                  for ticker in tickers]
+        dates = np.unique(np.concatenate(
+            [item['date'] for item in series if item is not None] +
+            [np.empty(0, dtype='datetime64[D]')]))
+
+        matrix = np.full((len(tickers), len(dates)), np.nan)
+        for row, item in enumerate(series):
+            if item is not None and len(item['date']):
+                matrix[row, np.searchsorted(dates, item['date'])] = \
+                    item[column]
+
+        return dates, matrix
+
+
+def FirstCloseByYear(dates, close):
+    """First close of each calendar year
+
+    :param dates: days of the bars, ascending
+    :type dates: numpy array of datetime64[D]
+    :param close: close of each day
+    :type close: numpy array
+    :return: years and their first close
+    :rtype: tuple
+    """
+    years = dates.astype('datetime64[Y]').astype(int) + 1970
+    years, first = np.unique(years, return_index=True)
+
+    return years, np.asarray(close)[first]
@@ -0,0 +1,37 @@
+// Rate dependent part of the decision machine, run on the browser so the
+// discount and margin sliders never reach the server. Mirrors
+// valuation.BatchMarginPricing, keep both in sync.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    valuation: {
+        futurePricing: function(inputs, discountRate, marginRate) {
+            if (!inputs) {
+                return [];
+            }
+
+            // NaN values arrive as null
+            var number = function(value) {
+                return value === null ? NaN : value;
+            };
+            var round = function(value) {
+                return Math.round(value * 100) / 100;
+            };
+
+            var FV = number(inputs.FV);
+            var lastSharePrice = number(inputs.last_share_price);
+            var PV = Math.abs(FV / Math.pow(1 + discountRate, inputs.years));
+            var marginPrice = FV > 0 ? PV * (1 - marginRate) : 0;
+
+            return [{
+                annual_growth_rate: round(number(inputs.annual_growth_rate)),
+                last_eps: round(number(inputs.last_eps)),
+                future_eps: round(number(inputs.future_eps)),
+                pe_ratio: round(number(inputs.pe_ratio)),
+                FV: round(FV),
+                PV: round(PV),
+                margin_price: round(marginPrice),
+                last_share_price: round(lastSharePrice),
+                decision: lastSharePrice < marginPrice ? 'COMPRAR' : 'VENDER'
+            }];
+        }
+    }
+});
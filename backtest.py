@@ -0,0 +1,341 @@
+"""Historical backtest of the COMPRAR/VENDER decision machine.
+
+Usage: python backtest.py [TICKER ...] [--discount 0.1 0.15 0.2]
+                          [--margin 0 0.1 0.15] [--horizons 1 3 5]
+                          [--window 5] [--lag 1] [--fetch]
+                          [--output .cache/backtest.csv]
+
+The rule is replayed at every year-end for every ticker at once, on
+(tickers, years) panels of EPS and closes, and the whole grid of discount
+and margin rates is decided in the same broadcast. Each decision is scored
+against the forward return of the following years: COMPRAR is a hit when
+the price went up, VENDER when it did not.
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from cache import CACHE_DIR
+from valuation import BatchFuturePricing, BatchMarginPricing, MinPriceEarnings
+
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_OUTPUT = os.path.join(CACHE_DIR, 'backtest.csv')
+
+
+def _Filled(matrix, backward=False):
+    """Column of the nearest valid value of each cell along the days,
+    looking back (or ahead when backward), -1 where there is none"""
+    index = np.arange(matrix.shape[1])
+    valid = ~np.isnan(matrix)
+    if backward:
+        nearest = np.where(valid, index, matrix.shape[1])
+        nearest = np.minimum.accumulate(nearest[:, ::-1], axis=1)[:, ::-1]
+        return np.where(nearest == matrix.shape[1], -1, nearest)
+
+    nearest = np.where(valid, index, -1)
+    return np.maximum.accumulate(nearest, axis=1)
+
+
+def YearlyCloses(dates, close, years):
+    """First and last close of each calendar year of a price panel
+
+    :param dates: days of the panel, ascending
+    :type dates: numpy array of datetime64[D]
+    :param close: closes, shape (tickers, days), nan where there is no bar
+    :type close: numpy array
+    :param years: calendar years
+    :type years: numpy array
+    :return: first and last close of each year, shape (tickers, years),
+        nan for the years a ticker has no bar
+    :rtype: tuple
+    """
+    close = np.asarray(close, dtype=float)
+    years = np.asarray(years)
+    rows = np.arange(close.shape[0])[:, None]
+    day_years = dates.astype('datetime64[Y]').astype(int) + 1970
+
+    def Take(nearest, columns):
+        columns = np.clip(columns, 0, max(len(dates) - 1, 0))
+        found = nearest[:, columns]
+        same_year = (found >= 0) & (
+            day_years[np.maximum(found, 0)] == years[None, :])
+        return np.where(same_year, close[rows, np.maximum(found, 0)],
+                        np.nan)
+
+    if not len(dates):
+        empty = np.full((close.shape[0], len(years)), np.nan)
+        return empty, empty.copy()
+
+    first = Take(_Filled(close, backward=True),
+                 np.searchsorted(day_years, years, side='left'))
+    last = Take(_Filled(close),
+                np.searchsorted(day_years, years, side='right') - 1)
+
+    return first, last
+
+
+def EpsPanel(reports, years):
+    """Diluted normalized EPS of many reports on a common grid of years
+
+    :param reports: fundamentals of each ticker, as from GetFiancialReport
+        or a dict of column lists, None when unknown
+    :type reports: list
+    :param years: fiscal years of the grid
+    :type years: numpy array
+    :return: EPS, shape (tickers, years), nan where not reported
+    :rtype: numpy array
+    """
+    years = np.asarray(years)
+    panel = np.full((len(reports), len(years)), np.nan)
+
+    for row, report in enumerate(reports):
+        if report is None:
+            continue
+        report_years = np.asarray(report['Year'], dtype=int)
+        eps = np.asarray(report['Diluted Normalized EPS'], dtype=float)
+        column = np.searchsorted(years, report_years)
+        inside = (column < len(years)) & (
+            years[np.minimum(column, len(years) - 1)] == report_years)
+        panel[row, column[inside]] = eps[inside]
+
+    return panel
+
+
+def BacktestSignals(years, eps, first_close, last_close, discount_rates,
+                    margin_rates, window=5, lag=1, horizons=(1, 3, 5),
+                    years_ahead=10):
+    """Decide every ticker at every year-end for every pair of rates
+
+    At the end of year Y the EPS of the fiscal years Y - lag - window + 1
+    to Y - lag are known. As on the dashboard, the oldest and newest of them
+    give the growth rate (over window periods), the lowest P/E of the window
+    prices the future EPS and the year-end close is the share price.
+
+    :param years: contiguous calendar years of the panels
+    :type years: numpy array
+    :param eps: EPS, shape (tickers, years)
+    :type eps: numpy array
+    :param first_close: first close of each year, shape (tickers, years)
+    :type first_close: numpy array
+    :param last_close: last close of each year, shape (tickers, years)
+    :type last_close: numpy array
+    :param discount_rates: expected annual returns to sweep
+    :type discount_rates: list
+    :param margin_rates: margins of safety to sweep
+    :type margin_rates: list
+    :param window: fiscal years used by the rule
+    :type window: int
+    :param lag: years between a fiscal year and its report being known
+    :type lag: int
+    :param horizons: years of each forward return
+    :type horizons: tuple
+    :param years_ahead: years ahead the EPS is projected
+    :type years_ahead: int
+    :return: 'buy' (discounts, margins, tickers, years) booleans, 'valued'
+        (tickers, years) mask of the decisions with enough data and
+        'forward' (horizons, tickers, years) returns
+    :rtype: dict
+    """
+    years = np.asarray(years)
+    eps = np.asarray(eps, dtype=float)
+    first_close = np.asarray(first_close, dtype=float)
+    last_close = np.asarray(last_close, dtype=float)
+
+    # (years, window) columns of the known fiscal years, oldest first
+    columns = (np.arange(len(years))[:, None] - lag - window + 1 +
+               np.arange(window)[None, :])
+    known = (columns >= 0) & (columns < len(years))
+    columns = np.clip(columns, 0, len(years) - 1)
+
+    eps_window = np.where(known, eps[:, columns], np.nan)
+    close_window = np.where(known, first_close[:, columns], np.nan)
+
+    pricing = BatchFuturePricing(first_eps=eps_window[..., 0],
+                                 last_eps=eps_window[..., -1],
+                                 pe_ratio=MinPriceEarnings(close_window,
+                                                           eps_window),
+                                 last_share_price=last_close,
+                                 discount_rate=0,
+                                 margin_rate=0,
+                                 periods=window,
+                                 years=years_ahead)
+
+    decisions = BatchMarginPricing(
+        pricing['FV'][None, None],
+        last_close[None, None],
+        np.asarray(discount_rates, dtype=float)[:, None, None, None],
+        np.asarray(margin_rates, dtype=float)[None, :, None, None],
+        years=years_ahead)
+
+    with np.errstate(invalid='ignore'):
+        valued = (np.isfinite(pricing['FV']) & np.isfinite(last_close) &
+                  (last_close > 0))
+
+    forward = np.full((len(horizons),) + last_close.shape, np.nan)
+    for position, horizon in enumerate(horizons):
+        if horizon < len(years):
+            forward[position, :, :-horizon] = (
+                last_close[:, horizon:] / last_close[:, :-horizon] - 1)
+
+    return dict(buy=decisions['decision'] == 'COMPRAR',
+                valued=valued,
+                forward=forward)
+
+
+def Backtest(years, eps, first_close, last_close, discount_rates,
+             margin_rates, window=5, lag=1, horizons=(1, 3, 5),
+             years_ahead=10):
+    """Hit rate and forward returns of the decision machine for each pair
+    of rates and horizon, see BacktestSignals for the arguments
+
+    :return: one row per discount rate, margin rate and horizon
+    :rtype: pandas dataframe
+    """
+    signals = BacktestSignals(years, eps, first_close, last_close,
+                              discount_rates, margin_rates, window=window,
+                              lag=lag, horizons=horizons,
+                              years_ahead=years_ahead)
+
+    # (horizons, discounts, margins, tickers, years)
+    forward = signals['forward'][:, None, None]
+    scored = signals['valued'] & ~np.isnan(forward)
+    buy = signals['buy'][None] & scored
+    sell = ~signals['buy'][None] & scored
+    with np.errstate(invalid='ignore'):
+        went_up = forward > 0
+
+    def Count(mask):
+        return mask.sum(axis=(-2, -1))
+
+    def Mean(mask):
+        total = np.where(mask, forward, 0.).sum(axis=(-2, -1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return total / Count(mask)
+
+    buys = Count(buy)
+    sells = Count(sell)
+    buy_hits = Count(buy & went_up)
+    sell_hits = Count(sell & ~went_up)
+    buy_return = Mean(buy)
+    sell_return = Mean(sell)
+    all_return = np.broadcast_to(Mean(scored), buys.shape)
+
+    horizon, discount, margin = np.meshgrid(np.arange(len(horizons)),
+                                            np.arange(len(discount_rates)),
+                                            np.arange(len(margin_rates)),
+                                            indexing='ij')
+    cell = (horizon.ravel(), discount.ravel(), margin.ravel())
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary = pd.DataFrame(dict(
+            discount_rate=np.asarray(discount_rates, dtype=float)[cell[1]],
+            margin_rate=np.asarray(margin_rates, dtype=float)[cell[2]],
+            horizon=np.asarray(horizons)[cell[0]],
+            signals=(buys + sells)[cell],
+            buys=buys[cell],
+            sells=sells[cell],
+            hit_rate=((buy_hits + sell_hits) / (buys + sells))[cell],
+            buy_hit_rate=(buy_hits / buys)[cell],
+            sell_hit_rate=(sell_hits / sells)[cell],
+            buy_return=buy_return[cell],
+            sell_return=sell_return[cell],
+            all_return=all_return[cell],
+            buy_excess_return=(buy_return - all_return)[cell]))
+
+    return summary.sort_values(['horizon', 'discount_rate', 'margin_rate']
+                               ).reset_index(drop=True)
+
+
+def LoadPanels(tickers, fetch=False):
+    """EPS and yearly close panels of the tickers from the fundamentals
+    and price archives
+
+    :param tickers: stock tickers
+    :type tickers: list
+    :param fetch: scrap the reports missing from the archive, or lacking
+        an expected fiscal year
+    :type fetch: bool
+    :return: years, EPS, first and last close of each year
+    :rtype: tuple
+    """
+    # imported here so the engine does not need selenium
+    import utils
+    from prices import price_store
+    from statements import fundamentals_archive
+
+    reports = []
+    for ticker in tickers:
+        try:
+            reports.append(utils.ArchivedReport(ticker) if fetch else
+                           fundamentals_archive.read(ticker))
+        except Exception:
+            logger.exception('Failed to load %s fundamentals', ticker)
+            reports.append(None)
+
+    dates, close = price_store.archive.panel(tickers, 'close')
+
+    known_years = [np.asarray(report['Year'], dtype=int)
+                   for report in reports if report is not None]
+    if len(dates):
+        known_years.append(dates[[0, -1]].astype('datetime64[Y]')
+                           .astype(int) + 1970)
+    if not known_years:
+        raise ValueError('No fundamentals nor prices for the tickers')
+    known_years = np.concatenate(known_years)
+    years = np.arange(known_years.min(), known_years.max() + 1)
+
+    first_close, last_close = YearlyCloses(dates, close, years)
+
+    return years, EpsPanel(reports, years), first_close, last_close
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('tickers', nargs='*',
+                        help='tickers to replay, defaults to the archived '
+                             'ones')
+    parser.add_argument('--discount', type=float, nargs='+',
+                        default=[0.1, 0.15, 0.2])
+    parser.add_argument('--margin', type=float, nargs='+',
+                        default=[0., 0.1, 0.15])
+    parser.add_argument('--horizons', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--window', type=int, default=5)
+    parser.add_argument('--lag', type=int, default=1)
+    parser.add_argument('--fetch', action='store_true',
+                        help='scrap the fundamentals missing from the archive')
+    parser.add_argument('--output', default=BACKTEST_OUTPUT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    tickers = args.tickers
+    if not tickers:
+        from prices import price_store
+        tickers = price_store.archive.tickers()
+
+    started = time.time()
+    years, eps, first_close, last_close = LoadPanels(tickers,
+                                                     fetch=args.fetch)
+    loaded = time.time()
+
+    summary = Backtest(years, eps, first_close, last_close,
+                       args.discount, args.margin, window=args.window,
+                       lag=args.lag, horizons=args.horizons)
+
+    logger.info('%d tickers, %d-%d, loaded in %.1fs and replayed in %.2fs',
+                len(tickers), years[0], years[-1], loaded - started,
+                time.time() - loaded)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    summary.to_csv(args.output, index=False)
+    print(summary.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
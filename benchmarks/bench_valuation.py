@@ -0,0 +1,103 @@
+"""Per-ticker cost of the batch valuation engine against the scalar path.
+
+Usage: python benchmarks/bench_valuation.py [--tickers 500 5000] [--repeat 5]
+
+The scalar reference uses np.rate/np.fv/np.pv (or numpy_financial on numpy
+releases that dropped them) exactly like the single-ticker FuturePricing
+used to, and the batch results are checked against it.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from valuation import BatchFuturePricing  # noqa: E402
+
+try:
+    import numpy_financial as npf
+except ImportError:
+    npf = np if hasattr(np, 'rate') else None
+
+
+def SyntheticUniverse(tickers, seed=0):
+    """Random but plausible fundamentals and prices for N tickers"""
+    rng = np.random.RandomState(seed)
+    first_eps = rng.uniform(0.1, 5., tickers)
+    last_eps = first_eps * rng.uniform(0.5, 3., tickers)
+    pe_ratio = rng.uniform(3., 30., tickers)
+    last_share_price = rng.uniform(1., 100., tickers)
+
+    return first_eps, last_eps, pe_ratio, last_share_price
+
+
+def ScalarFuturePricing(first_eps, last_eps, pe_ratio, last_share_price,
+                        discount_rate, margin_rate, years=10):
+    """The single-ticker computation FuturePricing used before the batch
+    engine"""
+    margin_price = 0
+    annual_growth_rate = npf.rate(5, 0, -first_eps, last_eps)
+    future_eps = abs(npf.fv(annual_growth_rate, years, 0, first_eps))
+    FV = future_eps * pe_ratio
+    PV = abs(npf.pv(discount_rate, years, 0, FV))
+    if FV > 0:
+        margin_price = PV * (1 - margin_rate)
+    decision = 'COMPRAR' if last_share_price < margin_price else 'VENDER'
+
+    return annual_growth_rate, future_eps, FV, PV, margin_price, decision
+
+
+def Best(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickers', type=int, nargs='+',
+                        default=[1, 50, 500, 5000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"tickers":>8} {"batch total":>12} {"batch/ticker":>13} '
+          f'{"scalar/ticker":>14} {"speedup":>8}')
+
+    for tickers in args.tickers:
+        universe = SyntheticUniverse(tickers)
+
+        batch_time, batch = Best(
+            lambda: BatchFuturePricing(*universe, discount_rate=0.2,
+                                       margin_rate=0.15), args.repeat)
+
+        if npf is None:
+            print(f'{tickers:>8} {batch_time * 1e3:>10.3f}ms '
+                  f'{batch_time / tickers * 1e6:>11.3f}us {"n/a":>14}')
+            continue
+
+        scalar_time, scalar = Best(
+            lambda: [ScalarFuturePricing(*values, 0.2, 0.15)
+                     for values in zip(*universe)], 1)
+
+        scalar = list(zip(*scalar))
+        np.testing.assert_allclose(batch['annual_growth_rate'], scalar[0])
+        np.testing.assert_allclose(batch['future_eps'], scalar[1])
+        np.testing.assert_allclose(batch['PV'], scalar[3])
+        np.testing.assert_allclose(batch['margin_price'], scalar[4])
+        assert batch['decision'].tolist() == list(scalar[5])
+
+        print(f'{tickers:>8} {batch_time * 1e3:>10.3f}ms '
+              f'{batch_time / tickers * 1e6:>11.3f}us '
+              f'{scalar_time / tickers * 1e6:>12.3f}us '
+              f'{scalar_time / batch_time:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Write the offline fixtures used by benchmarks/run.py.
+
+Usage: python benchmarks/make_fixtures.py
+
+The live Reuters and Yahoo pages can no longer be recorded reliably, so the
+fixtures reproduce their markup (the table nesting waited on by
+ScrapStatementTable, the Fw(b) links read by GetTickers, the Yahoo CSV
+columns) with deterministic values. The benchmark shifts their dates to the
+current year when serving them.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fixtures')
+
+FISCAL_YEARS = [2019, 2018, 2017, 2016, 2015]
+
+INCOME_ROWS = ['Total Revenue', 'Revenue', 'Other Revenue, Total',
+               'Cost of Revenue, Total', 'Gross Profit',
+               'Selling/General/Admin. Expenses, Total',
+               'Research & Development', 'Depreciation/Amortization',
+               'Interest Exp.(Inc.),Net-Operating, Total',
+               'Unusual Expense (Income)', 'Other Operating Expenses, Total',
+               'Total Operating Expense', 'Operating Income',
+               'Interest Income(Exp), Net Non-Operating',
+               'Gain (Loss) on Sale of Assets', 'Other, Net',
+               'Net Income Before Taxes', 'Provision for Income Taxes',
+               'Net Income After Taxes', 'Minority Interest',
+               'Net Income Before Extra. Items', 'Total Extraordinary Items',
+               'Net Income', 'Total Adjustments to Net Income',
+               'Income Available to Common Excl. Extra. Items',
+               'Dilution Adjustment', 'Diluted Net Income',
+               'Diluted Weighted Average Shares',
+               'Diluted EPS Excluding Extraordinary Items',
+               'DPS - Common Stock Primary Issue',
+               'Diluted Normalized EPS']
+
+BALANCE_ROWS = ['Cash', 'Cash & Equivalents', 'Short Term Investments',
+                'Cash and Short Term Investments',
+                'Accounts Receivable - Trade, Net', 'Total Receivables, Net',
+                'Total Inventory', 'Prepaid Expenses',
+                'Other Current Assets, Total', 'Total Current Assets',
+                'Property/Plant/Equipment, Total - Net', 'Goodwill, Net',
+                'Intangibles, Net', 'Long Term Investments',
+                'Other Long Term Assets, Total', 'Total Assets',
+                'Accounts Payable', 'Accrued Expenses', 'Notes Payable/Short Term Debt',
+                'Current Port. of LT Debt/Capital Leases',
+                'Other Current liabilities, Total',
+                'Total Current Liabilities', 'Long Term Debt',
+                'Capital Lease Obligations', 'Total Long Term Debt',
+                'Total Debt', 'Deferred Income Tax', 'Minority Interest',
+                'Other Liabilities, Total', 'Total Liabilities',
+                'Common Stock, Total', 'Additional Paid-In Capital',
+                'Retained Earnings (Accumulated Deficit)',
+                'Other Equity, Total', 'Total Equity',
+                "Total Liabilities & Shareholders' Equity",
+                'Total Common Shares Outstanding']
+
+INDUSTRY_TICKERS = 25
+
+
+def FormatCell(value):
+    if value is None:
+        return '--'
+    if value < 0:
+        return '({:,.2f})'.format(-value)
+    return '{:,.2f}'.format(value)
+
+
+def StatementPage(rows, values):
+    head = ''.join('<th><time>31-Dec-%02d</time></th>' % (year % 100)
+                   for year in FISCAL_YEARS)
+    body = ''.join('<tr><th><span>%s</span></th>%s</tr>' % (
+        label, ''.join('<td>%s</td>' % FormatCell(value)
+                       for value in values[label]))
+                   for label in rows)
+
+    return ('<!DOCTYPE html><html><head><title>Financials</title></head>'
+            '<body><div id="__next"><div><div></div><div></div><div></div>'
+            '<div><div><div><div><section><div></div><div><div></div>'
+            '<div></div><div><table><thead><tr><th></th>%s</tr></thead>'
+            '<tbody>%s</tbody></table></div></div></section></div></div>'
+            '</div></div></div></div></body></html>' % (head, body))
+
+
+def main():
+    rng = np.random.RandomState(42)
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+
+    def Series(level, growth=0.1, noise=0.05):
+        # most recent year first, as on Reuters
+        values = level * (1 + growth) ** np.arange(len(FISCAL_YEARS))[::-1]
+        return list(values * rng.uniform(1 - noise, 1 + noise,
+                                         len(FISCAL_YEARS)))
+
+    income = {label: Series(rng.uniform(100, 50000)) for label in INCOME_ROWS}
+    income['Net Income'] = Series(8000, growth=0.12)
+    income['Net Income Before Taxes'] = Series(11000, growth=0.12)
+    income['Diluted Normalized EPS'] = Series(1.8, growth=0.15)
+    income['Interest Exp.(Inc.),Net-Operating, Total'] = [
+        -value for value in Series(300)]
+    income['Unusual Expense (Income)'] = [None] * len(FISCAL_YEARS)
+
+    balance = {label: Series(rng.uniform(100, 90000))
+               for label in BALANCE_ROWS}
+    balance['Total Assets'] = Series(90000, growth=0.05)
+    balance['Total Long Term Debt'] = Series(30000, growth=0.02)
+    balance['Total Liabilities'] = Series(55000, growth=0.04)
+    balance["Total Liabilities & Shareholders' Equity"] = \
+        balance['Total Assets']
+
+    with open(os.path.join(FIXTURES_DIR, 'reuters_income.html'), 'w') as page:
+        page.write(StatementPage(INCOME_ROWS, income))
+    with open(os.path.join(FIXTURES_DIR, 'reuters_balance.html'), 'w') as page:
+        page.write(StatementPage(BALANCE_ROWS, balance))
+
+    links = ''.join(
+        '<tr><td><a class="Fw(b)" data-symbol="BNCH%d.SA" '
+        'title="Empresa Benchmark %d S.A." href="/quote/BNCH%d.SA">'
+        'BNCH%d.SA</a></td><td>%.2f</td></tr>' % (
+            index, index, index, index, rng.uniform(1, 100))
+        for index in range(INDUSTRY_TICKERS))
+    with open(os.path.join(FIXTURES_DIR, 'yahoo_industry.html'), 'w') as page:
+        page.write('<!DOCTYPE html><html><body><table><thead><tr>'
+                   '<th>Símbolo</th><th>Preço</th></tr></thead><tbody>%s'
+                   '</tbody></table></body></html>' % links)
+
+    dates = pd.bdate_range('2015-01-02', '2019-12-30')
+    close = 20 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(dates))))
+    spread = rng.uniform(0.002, 0.02, len(dates))
+    prices = pd.DataFrame({'Open': close * (1 + rng.uniform(-1, 1, len(dates)) * spread),
+                           'High': close * (1 + spread),
+                           'Low': close * (1 - spread),
+                           'Close': close,
+                           'Adj Close': close,
+                           'Volume': rng.randint(1e5, 1e7, len(dates))},
+                          index=pd.Index(dates, name='Date'))
+    prices['High'] = prices[['Open', 'High']].max(axis=1)
+    prices['Low'] = prices[['Open', 'Low']].min(axis=1)
+    prices.round(4).to_csv(os.path.join(FIXTURES_DIR, 'yahoo_prices.csv'))
+
+
+if __name__ == '__main__':
+    main()
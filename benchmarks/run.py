@@ -0,0 +1,178 @@
+"""Offline benchmark suite, emitting JSON to compare commits.
+
+Usage: python benchmarks/run.py [--sizes 1 50 500] [--repeat 3]
+                                [--output bench.json]
+
+Reuters and Yahoo are replaced by a local HTTP server answering with the
+fixtures of benchmarks/fixtures, the webdriver by a urllib3 stub and
+pandas_datareader by the recorded price CSV. Every run uses a fresh
+CACHE_DIR, so cold timings include scraping and archiving.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime as dt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stubs import (FixtureServer, ReadFixture, StubDriver,  # noqa: E402
+                   StubPriceFetcher)
+
+
+def Measure(results, name, size, func, repeat):
+    """Best of repeat runs of func, which handles size items"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    result = dict(name=name,
+                  size=size,
+                  repeat=repeat,
+                  best_s=best,
+                  mean_s=sum(timings) / len(timings),
+                  per_item_ms=best / size * 1e3,
+                  throughput_per_s=size / best if best else None)
+    results.append(result)
+    print(f'{name:<28} {size:>5} {best * 1e3:>12.3f}ms '
+          f'{result["per_item_ms"]:>10.4f}ms/item', file=sys.stderr)
+
+
+def GitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL
+                                       ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 50, 500])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file, defaults to stdout')
+    args = parser.parse_args()
+
+    server = FixtureServer().start()
+    os.environ['CACHE_DIR'] = tempfile.mkdtemp(prefix='b3bench-')
+    os.environ['REUTERS_URL'] = server.url + '/companies/'
+    os.environ['YAHOO_FINANCE_URL'] = server.url + '/industries/'
+    os.environ['WARMER_ENABLED'] = '0'
+
+    import numpy as np
+    import pandas as pd
+    import backtest
+    import prices
+    import statements
+    import utils
+    import valuation
+
+    utils.driver_pool.factory = StubDriver
+    prices.price_store.fetcher = StubPriceFetcher
+
+    try:
+        import app
+    except ImportError as error:
+        # dash is not installed, the callbacks are skipped
+        app = None
+        print(f'Skipping the callback benchmarks: {error}', file=sys.stderr)
+
+    results = []
+    repeat = args.repeat
+    income_page = ReadFixture('reuters_income.html').decode('utf-8')
+
+    Measure(results, 'parse_statement', 1,
+            lambda: utils.ParseStatementTable(income_page), repeat)
+    Measure(results, 'get_tickers', len(utils.B3_INDUSTRIES),
+            utils.GetTickers, repeat)
+
+    for size in args.sizes:
+        tickers = ['BNCH%d.SA' % index for index in range(size)]
+
+        Measure(results, 'scrap_report', size,
+                lambda: [utils.ScrapFinancialReport(ticker)
+                         for ticker in tickers], 1)
+
+        reports = [utils.GetFiancialReport(ticker).to_dict('list')
+                   for ticker in tickers]
+        Measure(results, 'check_warning_flags', size,
+                lambda: [utils.CheckWarningFlags(report)
+                         for report in reports], repeat)
+        Measure(results, 'market_warning_flags', size,
+                lambda: utils.MarketWarningFlags(reports), repeat)
+
+        for ticker in tickers:
+            utils.GetPriceArrays(ticker)
+        Measure(results, 'pricing_inputs', size,
+                lambda: [utils.PriceDecision(
+                    utils.PricingInputs(ticker, report), 0.2, 0.15)
+                    for ticker, report in zip(tickers, reports)], repeat)
+
+        rng = np.random.RandomState(size)
+        Measure(results, 'valuation_batch', size,
+                lambda: valuation.BatchFuturePricing(
+                    rng.uniform(0.1, 5, size), rng.uniform(0.1, 5, size),
+                    rng.uniform(3, 30, size), rng.uniform(1, 100, size),
+                    0.2, 0.15), repeat)
+
+        # three decades of year-end panels against a 6x7 grid of rates
+        years = np.arange(1990, 2020)
+        eps = rng.uniform(0.1, 5, (size, len(years)))
+        closes = rng.uniform(1, 100, (2, size, len(years)))
+        Measure(results, 'backtest_grid', size,
+                lambda: backtest.Backtest(years, eps, closes[0], closes[1],
+                                          np.linspace(0.05, 0.3, 6),
+                                          np.linspace(0, 0.3, 7)), repeat)
+
+        if app is None:
+            continue
+
+        def Callbacks():
+            for ticker in tickers:
+                fundamentals, _ = app.UpdateTable(ticker)
+                app.CreateReasonList(fundamentals)
+                app.UpdatePricingInputs(fundamentals, ticker)
+                app.UpdateStockGraph(ticker)
+
+        def Cold():
+            # the fundamentals archive is append-only, start a new one
+            utils.fundamentals_archive = statements.FundamentalsArchive(
+                os.path.join(tempfile.mkdtemp(prefix='b3bench-'),
+                             'statements.sqlite'))
+            utils.InvalidateFinancialReport()
+            for ticker in tickers:
+                prices.price_store.invalidate(ticker)
+            Callbacks()
+
+        Measure(results, 'callbacks_cold', size, Cold, 1)
+        Measure(results, 'callbacks_warm', size, Callbacks, repeat)
+
+    server.stop()
+
+    report = dict(commit=GitCommit(),
+                  timestamp=dt.utcnow().isoformat() + 'Z',
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  numpy=np.__version__,
+                  pandas=pd.__version__,
+                  results=results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
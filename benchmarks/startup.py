@@ -0,0 +1,78 @@
+"""Import time and memory budget of a web worker.
+
+Usage: python benchmarks/startup.py [--module app] [--max-seconds 1]
+                                    [--max-rss-mb 200] [--repeat 3]
+
+The module is imported in fresh interpreters, the way the gunicorn master
+preloads it, and the best wall time and the peak RSS are compared with the
+budget. Scraping libraries must not be imported at startup. Exits with 1
+when the budget is exceeded.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported on first use only
+LAZY_MODULES = ['selenium', 'bs4', 'lxml', 'pandas_datareader']
+
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps(dict(
+    seconds=seconds,
+    rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+    eager=[name for name in {lazy!r} if name in sys.modules])))
+'''
+
+
+def Probe(module):
+    """Import module in a new interpreter
+
+    :return: seconds, peak RSS in MB and the lazy modules it imported
+    :rtype: dict
+    """
+    env = dict(os.environ,
+               CACHE_DIR=tempfile.mkdtemp(prefix='b3startup-'),
+               APP_PRELOADED='1',
+               WARMER_ENABLED='0')
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE.format(module=module,
+                                            lazy=LAZY_MODULES)],
+        cwd=ROOT, env=env)
+
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--max-seconds', type=float, default=1.)
+    parser.add_argument('--max-rss-mb', type=float, default=200.)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # the first run also pays for cold .pyc and disk caches
+    probes = [Probe(args.module) for _ in range(args.repeat)]
+    result = dict(module=args.module,
+                  seconds=min(probe['seconds'] for probe in probes),
+                  rss_mb=max(probe['rss_mb'] for probe in probes),
+                  eager=probes[-1]['eager'],
+                  max_seconds=args.max_seconds,
+                  max_rss_mb=args.max_rss_mb)
+    result['ok'] = (result['seconds'] <= args.max_seconds and
+                    result['rss_mb'] <= args.max_rss_mb and
+                    not result['eager'])
+    print(json.dumps(result, indent=2))
+
+    sys.exit(0 if result['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Offline stand-ins for Reuters, Yahoo and the selenium webdriver."""
+from datetime import datetime as dt
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import os
+import re
+import threading
+
+import pandas as pd
+import urllib3
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fixtures')
+
+# most recent fiscal year of the statement fixtures
+FIXTURE_LAST_YEAR = 2019
+
+
+def ReadFixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as fixture:
+        return fixture.read()
+
+
+def ShiftYears(page, offset):
+    """Move the <time>DD-Mon-YY</time> headers of a statement page"""
+    return re.sub(rb'(<time>\d{2}-\w{3}-)(\d{2})(</time>)',
+                  lambda match: b'%s%02d%s' % (
+                      match.group(1), (int(match.group(2)) + offset) % 100,
+                      match.group(3)),
+                  page)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FixtureServer(object):
+    """Local HTTP server answering the Reuters and Yahoo urls with the
+    fixtures, the statement years moved so the last one is last year"""
+
+    def __init__(self):
+        offset = dt.now().year - 1 - FIXTURE_LAST_YEAR
+        routes = {
+            '/financials/income-statement-annual':
+                ShiftYears(ReadFixture('reuters_income.html'), offset),
+            '/financials/balance-sheet-annual':
+                ShiftYears(ReadFixture('reuters_balance.html'), offset),
+            '/industries/': ReadFixture('yahoo_industry.html'),
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                for route, body in routes.items():
+                    if route in self.path:
+                        self.send_response(200)
+                        self.send_header('Content-Type',
+                                         'text/html; charset=utf-8')
+                        self.send_header('Content-Length', str(len(body)))
+                        self.end_headers()
+                        self.wfile.write(body)
+                        return
+                self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Element(object):
+
+    def is_displayed(self):
+        return True
+
+
+class StubDriver(object):
+    """Just enough of a selenium webdriver for ScrapStatementTable: pages are
+    downloaded with urllib3 and every element is reported visible"""
+
+    _http = urllib3.PoolManager(maxsize=8)
+
+    def __init__(self):
+        self.current_url = None
+        self.page_source = ''
+
+    def get(self, url):
+        self.page_source = self._http.request('GET', url).data.decode('utf-8')
+        self.current_url = url
+
+    def find_element(self, by=None, value=None):
+        return _Element()
+
+    def quit(self):
+        pass
+
+
+_prices = {}
+
+
+def StubPriceFetcher(ticker, start, end):
+    """pandas_datareader stand-in returning the recorded CSV, its bars moved
+    so the last one is the last business day"""
+    if 'frame' not in _prices:
+        frame = pd.read_csv(os.path.join(FIXTURES_DIR, 'yahoo_prices.csv'),
+                            index_col='Date', parse_dates=True)
+        frame.index = pd.bdate_range(end=pd.Timestamp(dt.now().date()) -
+                                     pd.offsets.BDay(1),
+                                     periods=len(frame), name='Date')
+        _prices['frame'] = frame
+
+    frame = _prices['frame']
+    return frame.loc[pd.Timestamp(start).normalize():pd.Timestamp(end)]
@@ -0,0 +1,221 @@
+from contextlib import contextmanager
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+CACHE_DIR = os.environ.get(
+    'CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+
+class DiskCache(object):
+    """Key/value cache persisted on a local SQLite file.
+
+    The file is shared by every gunicorn worker and survives restarts. Each
+    entry has its own TTL and the table is kept under ``max_entries`` and
+    ``max_bytes`` by evicting the least recently used rows.
+    """
+
+    def __init__(self, path, default_ttl=None, max_entries=1000,
+                 max_bytes=256 * 1024 * 1024):
+        """
+        :param path: path of the SQLite file
+        :type path: str
+        :param default_ttl: seconds an entry stays fresh, None for no expiry
+        :type default_ttl: int
+        :param max_entries: maximum number of entries kept on disk
+        :type max_entries: int
+        :param max_bytes: maximum size of all the pickled values
+        :type max_bytes: int
+        """
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                         'key TEXT PRIMARY KEY, '
+                         'value BLOB NOT NULL, '
+                         'size INTEGER NOT NULL, '
+                         'stored_at REAL NOT NULL, '
+                         'expires_at REAL, '
+                         'accessed_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed_at '
+                         'ON cache (accessed_at)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def get(self, key, default=None, count=True):
+        """Return the value stored for key or default when missing/expired
+
+        :param key: cache key
+        :type key: str
+        :param count: add the lookup to the hit/miss counters, False for a
+            second lookup of the same request
+        :type count: bool
+        :return: unpickled value
+        :rtype: object
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, expires_at FROM cache '
+                               'WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                if count:
+                    self._count(False)
+                return default
+            conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?',
+                         (now, key))
+
+        if count:
+            self._count(True)
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Store value under key and evict the LRU entries over the bounds
+
+        :param key: cache key
+        :type key: str
+        :param value: any picklable object
+        :type value: object
+        :param ttl: seconds the entry stays fresh, defaults to default_ttl
+        :type ttl: int
+        """
+        if ttl is None:
+            ttl = self.default_ttl
+
+        now = time.time()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        expires_at = now + ttl if ttl is not None else None
+
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache '
+                         '(key, value, size, stored_at, expires_at, '
+                         'accessed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, sqlite3.Binary(blob), len(blob), now,
+                          expires_at, now))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        conn.execute('DELETE FROM cache WHERE expires_at IS NOT NULL '
+                     'AND expires_at <= ?', (time.time(),))
+
+        count, total = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        rows = conn.execute('SELECT key, size FROM cache '
+                            'ORDER BY accessed_at ASC').fetchall()
+        evicted = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total -= size
+
+        conn.executemany('DELETE FROM cache WHERE key = ?', evicted)
+
+    def invalidate(self, key=None):
+        """Remove key from the cache, or every entry when key is None
+
+        :param key: cache key
+        :type key: str
+        """
+        with self._connect() as conn:
+            if key is None:
+                conn.execute('DELETE FROM cache')
+            else:
+                conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def info(self, key):
+        """Timestamps of the entry, without touching its LRU position
+
+        :param key: cache key
+        :type key: str
+        :return: stored_at and expires_at, None when missing or expired
+        :rtype: dict
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT stored_at, expires_at FROM cache '
+                               'WHERE key = ?', (key,)).fetchone()
+
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+
+        return dict(stored_at=row[0], expires_at=row[1])
+
+    def get_or_set(self, key, func, ttl=None, refresh=False):
+        """Return the cached value for key, calling func on a miss
+
+        :param key: cache key
+        :type key: str
+        :param func: callable without arguments producing the value
+        :type func: function
+        :param ttl: seconds the new entry stays fresh
+        :type ttl: int
+        :param refresh: ignore the stored value and call func again
+        :type refresh: bool
+        :return: cached or freshly computed value
+        :rtype: object
+        """
+        missing = object()
+        value = missing if refresh else self.get(key, missing)
+
+        if value is missing:
+            value = func()
+            self.set(key, value, ttl=ttl)
+
+        return value
+
+    def stats(self):
+        """Hit/miss counters of this process and the on-disk usage
+
+        :return: counters
+        :rtype: dict
+        """
+        with self._connect() as conn:
+            count, total = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+            ).fetchone()
+
+        with self._lock:
+            return dict(hits=self._hits,
+                        misses=self._misses,
+                        entries=count,
+                        bytes=total)
+
+
+fundamentals_cache = DiskCache(
+    os.path.join(CACHE_DIR, 'fundamentals.sqlite'),
+    default_ttl=int(os.environ.get('FUNDAMENTALS_TTL', 30 * 24 * 3600)),
+    max_entries=int(os.environ.get('FUNDAMENTALS_MAX_ENTRIES', 2000)))
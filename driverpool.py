@@ -0,0 +1,190 @@
+import atexit
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """Raised when no webdriver is freed before the checkout timeout"""
+
+
+class WebDriverPool(object):
+    """Bounded pool of long-lived selenium webdrivers.
+
+    Browsers are started lazily up to ``max_size``; once they are all checked
+    out the next callers wait for one to be checked in. A driver is quit and
+    replaced after ``max_pages`` page loads, when it fails the health check,
+    or when the session using it crashes or times out.
+    """
+
+    def __init__(self, factory, max_size=2, max_pages=50,
+                 checkout_timeout=120):
+        """
+        :param factory: callable without arguments returning a new webdriver
+        :type factory: function
+        :param max_size: maximum number of browsers alive at the same time
+        :type max_size: int
+        :param max_pages: page loads served by a browser before recycling it
+        :type max_pages: int
+        :param checkout_timeout: seconds to wait for a free browser
+        :type checkout_timeout: float
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self.checkout_timeout = checkout_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._pages = {}
+        self._created = 0
+        self._waiting = 0
+
+        atexit.register(self.close)
+
+    def checkout(self, timeout=None):
+        """Take a healthy webdriver from the pool, starting one if allowed
+
+        :param timeout: seconds to wait, defaults to checkout_timeout
+        :type timeout: float
+        :return: selenium webdriver
+        :rtype: object
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+        deadline = time.time() + timeout
+
+        while True:
+            with self._cond:
+                self._waiting += 1
+                try:
+                    while not self._idle and self._created >= self.max_size:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                'No webdriver available after %ss' % timeout)
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+                if self._idle:
+                    driver = self._idle.popleft()
+                else:
+                    driver = None
+                    self._created += 1
+
+            if driver is None:
+                try:
+                    driver = self.factory()
+                except Exception:
+                    with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+                self._pages[id(driver)] = 0
+                return driver
+
+            if self._is_healthy(driver):
+                return driver
+
+            self._discard(driver)
+
+    def checkin(self, driver, pages=1, broken=False):
+        """Give the webdriver back to the pool
+
+        :param driver: webdriver taken with checkout
+        :type driver: object
+        :param pages: number of pages loaded during the checkout
+        :type pages: int
+        :param broken: quit the browser instead of reusing it
+        :type broken: bool
+        """
+        self._pages[id(driver)] = self._pages.get(id(driver), 0) + pages
+
+        if broken or self._pages[id(driver)] >= self.max_pages:
+            self._discard(driver)
+            return
+
+        with self._cond:
+            self._idle.append(driver)
+            self._cond.notify()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Context manager around checkout/checkin.
+
+        The yielded object is a PooledDriver, so page loads are counted
+        for the recycling policy. Crashes and selenium timeouts discard the
+        browser instead of returning it to the pool.
+        """
+        # imported on first use, so the web workers start without selenium
+        from selenium.common.exceptions import (TimeoutException,
+                                                WebDriverException)
+
+        driver = PooledDriver(self.checkout(timeout))
+        try:
+            yield driver
+        except (TimeoutException, WebDriverException):
+            self.checkin(driver.driver, driver.pages, broken=True)
+            raise
+        except BaseException:
+            self.checkin(driver.driver, driver.pages)
+            raise
+        else:
+            self.checkin(driver.driver, driver.pages)
+
+    def _is_healthy(self, driver):
+        try:
+            driver.current_url
+        except Exception:
+            return False
+        return True
+
+    def _discard(self, driver):
+        self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def stats(self):
+        """Occupancy of the pool
+
+        :return: alive, idle, busy and waiting counters
+        :rtype: dict
+        """
+        with self._cond:
+            return dict(size=self._created,
+                        idle=len(self._idle),
+                        busy=self._created - len(self._idle),
+                        waiting=self._waiting,
+                        max_size=self.max_size)
+
+    def close(self):
+        """Quit every idle browser"""
+        with self._cond:
+            drivers = list(self._idle)
+            self._idle.clear()
+
+        for driver in drivers:
+            self._discard(driver)
+
+
+class PooledDriver(object):
+    """Thin proxy counting the page loads of a pooled webdriver"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+    def get(self, url):
+        self.pages += 1
+        return self.driver.get(url)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
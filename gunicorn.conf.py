@@ -0,0 +1,28 @@
+"""gunicorn settings: the app is imported once by the master and forked,
+so the workers share its read-only memory and start without importing
+anything.
+
+Usage: gunicorn --config gunicorn.conf.py app:server
+"""
+import gc
+import os
+
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+if preload_app:
+    # app.py leaves its threads to post_fork
+    os.environ['APP_PRELOADED'] = '1'
+
+
+def when_ready(server):
+    # objects of the preloaded app are never collected, so the garbage
+    # collector does not write to (and copy) their shared pages
+    if preload_app and hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.StartBackgroundThreads()
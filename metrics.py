@@ -0,0 +1,160 @@
+"""Hot path instrumentation exposed in the Prometheus text format.
+
+Stage timings are histograms kept per process (each gunicorn worker serves
+its own), while occupancy numbers such as the browser pool or the cache
+counters are read from their owners when /metrics is scraped. Set
+METRICS_LOG to a file path, or to '-' for stderr, to also write every timing
+as a JSON line for offline profiling.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a cached callback to a slow Selenium scrap
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30,
+           60, 120)
+
+
+class _Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _Labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in sorted(labels.items()))
+
+
+class Registry(object):
+    """Stage histograms and collected metrics of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._collectors = []
+        self._log = None
+
+        log_path = os.environ.get('METRICS_LOG')
+        if log_path:
+            self._log = logging.getLogger('b3valueinvesting.metrics')
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            self._log.addHandler(logging.StreamHandler(sys.stderr)
+                                 if log_path == '-' else
+                                 logging.FileHandler(log_path))
+
+    def observe(self, stage, seconds, **fields):
+        """Record the duration of a stage
+
+        :param stage: stage name, e.g. 'page_load'
+        :type stage: str
+        :param seconds: duration
+        :type seconds: float
+        """
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = _Histogram()
+            histogram.observe(seconds)
+
+        if self._log is not None:
+            self._log.info(json.dumps(dict(fields, ts=time.time(),
+                                           stage=stage, seconds=seconds),
+                                      default=str))
+
+    def register(self, name, kind, help_text, func):
+        """Read a metric from its owner at each scrape
+
+        :param name: metric name
+        :type name: str
+        :param kind: 'gauge' or 'counter'
+        :type kind: str
+        :param help_text: HELP line
+        :type help_text: str
+        :param func: callable returning a list of (labels dict, value)
+        :type func: function
+        """
+        with self._lock:
+            self._collectors.append((name, kind, help_text, func))
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """Time the body of the with statement as stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **fields)
+
+    def timed(self, stage):
+        """Decorator timing every call of the function as stage"""
+        def Decorator(func):
+            @functools.wraps(func)
+            def Wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return Wrapper
+        return Decorator
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format
+
+        :rtype: str
+        """
+        lines = []
+
+        with self._lock:
+            histograms = {stage: (list(histogram.counts), histogram.count,
+                                  histogram.sum)
+                          for stage, histogram in self._histograms.items()}
+            collectors = list(self._collectors)
+
+        lines.append('# HELP b3_stage_duration_seconds Duration of each '
+                     'hot path stage')
+        lines.append('# TYPE b3_stage_duration_seconds histogram')
+        for stage, (counts, count, total) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append('b3_stage_duration_seconds_bucket%s %d' % (
+                    _Labels(dict(stage=stage, le=bound)), cumulative))
+            lines.append('b3_stage_duration_seconds_count%s %d' % (
+                _Labels(dict(stage=stage)), count))
+            lines.append('b3_stage_duration_seconds_sum%s %.6f' % (
+                _Labels(dict(stage=stage)), total))
+
+        for name, kind, help_text, func in collectors:
+            try:
+                samples = func()
+            except Exception:
+                logger.exception('Failed to collect %s', name)
+                continue
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, _Labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+# candle sizes, from the finest, and the calendar days each one spans
+CANDLE_DAYS = [('D', 7 / 5.), ('W', 7.), ('M', 365.25 / 12), ('Y', 365.25)]
+
+# 1970-01-05 was the first monday after the datetime64 epoch
+_FIRST_MONDAY = 4
+
+
+def ResampleOHLC(arrays, frequency):
+    """Roll daily bars up into weekly, monthly or yearly candles
+
+    :param arrays: 'date', 'open', 'high', 'low' and 'close' arrays of
+        daily bars, ascending, as from GetPriceArrays
+    :type arrays: dict
+    :param frequency: 'D', 'W' (weeks starting on monday), 'M' or 'Y'
+    :type frequency: str
+    :return: same columns, one row per candle dated by its first day
+    :rtype: dict
+    """
+    dates = np.asarray(arrays['date'], dtype='datetime64[D]')
+    columns = {name: np.asarray(arrays[name], dtype=float)
+               for name in ('open', 'high', 'low', 'close')}
+
+    complete = ~np.any([np.isnan(values) for values in columns.values()],
+                       axis=0)
+    dates = dates[complete]
+    columns = {name: values[complete] for name, values in columns.items()}
+
+    if frequency == 'D' or not len(dates):
+        return dict(columns, date=dates)
+
+    if frequency == 'W':
+        keys = (dates.astype(int) - _FIRST_MONDAY) // 7
+    else:
+        keys = dates.astype('datetime64[%s]' % frequency)
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    ends = np.append(starts[1:], len(dates)) - 1
+
+    return dict(date=dates[starts],
+                open=columns['open'][starts],
+                high=np.maximum.reduceat(columns['high'], starts),
+                low=np.minimum.reduceat(columns['low'], starts),
+                close=columns['close'][ends])
+
+
+def CandleFrequency(start, end, max_candles=400):
+    """Finest candle size keeping the period within max_candles
+
+    :param start: first day shown
+    :type start: numpy.datetime64
+    :param end: last day shown
+    :type end: numpy.datetime64
+    :return: 'D', 'W', 'M' or 'Y'
+    :rtype: str
+    """
+    days = (np.datetime64(end, 'D') - np.datetime64(start, 'D')).astype(int)
+    for frequency, candle_days in CANDLE_DAYS:
+        if days / candle_days <= max_candles:
+            return frequency
+
+    return CANDLE_DAYS[-1][0]
+
+
+def ZoomRange(relayout_data):
+    """Visible dates of a plotly relayoutData, None when autoranged
+
+    :param relayout_data: relayoutData of a dcc.Graph
+    :type relayout_data: dict
+    :return: first and last visible days
+    :rtype: tuple
+    """
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+
+    if 'xaxis.range[0]' in relayout_data:
+        bounds = (relayout_data['xaxis.range[0]'],
+                  relayout_data.get('xaxis.range[1]'))
+    else:
+        bounds = relayout_data.get('xaxis.range') or (None, None)
+
+    try:
+        # plotly sends 'YYYY-MM-DD HH:MM:SS.ffff'
+        return tuple(np.datetime64(str(bound)[:10], 'D') for bound in bounds)
+    except (TypeError, ValueError):
+        return None
+
+
+def CandlestickTrace(arrays, start=None, end=None, max_candles=400):
+    """Candlestick of the bars around [start, end] with at most about
+    3 * max_candles candles, whatever the length of the history
+
+    The candle size is picked for the visible period, and one more period
+    is sent on each side so panning does not show an empty chart. Values
+    are plain lists of 'YYYY-MM-DD' strings and prices rounded to cents,
+    much lighter to encode than pandas series.
+
+    :param arrays: daily bars, as from GetPriceArrays
+    :type arrays: dict
+    :param start: first visible day, defaults to the first bar
+    :type start: numpy.datetime64
+    :param end: last visible day, defaults to the last bar
+    :type end: numpy.datetime64
+    :return: plotly candlestick trace and its candle size
+    :rtype: tuple
+    """
+    dates = np.asarray(arrays['date'], dtype='datetime64[D]')
+    if not len(dates):
+        return dict(type='candlestick', x=[], open=[], high=[], low=[],
+                    close=[]), 'D'
+
+    start = dates[0] if start is None else np.datetime64(start, 'D')
+    end = dates[-1] if end is None else np.datetime64(end, 'D')
+    frequency = CandleFrequency(start, end, max_candles)
+
+    span = end - start
+    first = np.searchsorted(dates, start - span, side='left')
+    last = np.searchsorted(dates, end + span, side='right')
+    candles = ResampleOHLC({name: values[first:last]
+                            for name, values in arrays.items()
+                            if name in ('date', 'open', 'high', 'low',
+                                        'close')},
+                           frequency)
+
+    return dict(type='candlestick',
+                x=np.datetime_as_string(candles['date']).tolist(),
+                open=np.round(candles['open'], 2).tolist(),
+                high=np.round(candles['high'], 2).tolist(),
+                low=np.round(candles['low'], 2).tolist(),
+                close=np.round(candles['close'], 2).tolist()), frequency
@@ -0,0 +1,253 @@
+"""Daily price history of the B3 tickers.
+
+Usage: python prices.py update [TICKER ...] [--years 5]
+       python prices.py compact [TICKER ...]
+
+update downloads the new bars of every ticker (defaults to the tickers
+snapshot) into the archive; compact merges the daily segments.
+"""
+import argparse
+from collections import OrderedDict
+from datetime import datetime as dt, timedelta
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from archive import ARCHIVE_COLUMNS, PriceArchive
+from cache import CACHE_DIR
+from metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+def YahooFetch(ticker, start, end):
+    """Download the daily OHLC bars of the ticker from Yahoo
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :param start: first day to download
+    :type start: datetime
+    :param end: last day to download
+    :type end: datetime
+    :return: bars indexed by date
+    :rtype: pandas dataframe
+    """
+    # slow to import, only loaded when a download is needed
+    import pandas_datareader as dr
+
+    with registry.timer('yahoo_download', ticker=ticker):
+        return dr.DataReader(ticker, data_source='yahoo', start=start,
+                             end=end)
+
+
+def FrameColumns(frame):
+    """Days and archive columns of a Yahoo dataframe
+
+    :param frame: bars indexed by date
+    :type frame: pandas dataframe
+    :return: datetime64[D] days and a dict of float arrays
+    :rtype: tuple
+    """
+    frame = frame.sort_index()
+    frame = frame[~frame.index.duplicated(keep='last')]
+    dates = frame.index.values.astype('datetime64[D]')
+    columns = {name: (frame[column].values.astype(float)
+                      if column in frame else np.full(len(frame), np.nan))
+               for column, name in ARCHIVE_COLUMNS.items()}
+
+    return dates, columns
+
+
+def HistoryFrame(arrays):
+    """Dataframe of the column arrays of a price history
+
+    :param arrays: 'date' plus one array per archive column
+    :type arrays: dict
+    :return: daily OHLC bars indexed by date
+    :rtype: pandas dataframe
+    """
+    return pd.DataFrame({column: arrays[name]
+                         for column, name in ARCHIVE_COLUMNS.items()},
+                        index=pd.DatetimeIndex(arrays['date'], name='Date'))
+
+
+class PriceStore(object):
+    """Incremental price history keyed by ticker, on top of the archive.
+
+    Only the bars newer than the last archived day (or older than the first
+    covered day) are downloaded, and at most once per max_staleness across
+    every worker, the time of the last check being kept on the manifest.
+    The memory-mapped arrays of the most recent tickers are kept on a
+    bounded in-memory LRU shared by every callback.
+    """
+
+    def __init__(self, archive, max_memory=64, max_staleness=3600,
+                 fetcher=YahooFetch):
+        """
+        :param archive: columnar archive of the bars
+        :type archive: PriceArchive
+        :param max_memory: number of series kept in memory
+        :type max_memory: int
+        :param max_staleness: seconds before checking Yahoo for new bars
+        :type max_staleness: int
+        :param fetcher: callable (ticker, start, end) returning new bars
+        :type fetcher: function
+        """
+        self.archive = archive
+        self.max_memory = max_memory
+        self.max_staleness = max_staleness
+        self.fetcher = fetcher
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+    def _arrays(self, ticker, coverage):
+        with self._lock:
+            if ticker in self._memory:
+                self._memory.move_to_end(ticker)
+                stored_coverage, arrays = self._memory[ticker]
+                # backfilled or appended by another worker since it was
+                # memory mapped, when the coverage moved
+                if stored_coverage == coverage:
+                    return arrays
+
+        arrays = self.archive.read(ticker)
+        if arrays is None:
+            return None
+
+        with self._lock:
+            self._memory[ticker] = (coverage, arrays)
+            self._memory.move_to_end(ticker)
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+
+        return arrays
+
+    def _forget(self, ticker):
+        with self._lock:
+            self._memory.pop(ticker, None)
+
+    def sync(self, ticker, start, sync=True):
+        """Make the archive cover start and, when sync and stale, today
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param start: first day the history must cover
+        :type start: datetime
+        :param sync: check Yahoo for new bars when the series is stale,
+            otherwise the network is only used for unknown tickers
+        :type sync: bool
+        """
+        start = pd.Timestamp(start).normalize()
+        coverage = self.archive.coverage(ticker)
+
+        if coverage is None or coverage[1] is None:
+            dates, columns = FrameColumns(self.fetcher(ticker, start,
+                                                       dt.now()))
+            # replaced at once, readers never see the ticker missing
+            self.archive.rewrite(ticker, dates, columns, start=start)
+            self.archive.mark_synced(ticker)
+            self._forget(ticker)
+            return
+
+        covered_start = pd.Timestamp(coverage[0])
+        if start < covered_start:
+            older = self.fetcher(ticker, start,
+                                 covered_start - timedelta(1))
+            arrays = self.archive.read(ticker)
+            stored = pd.DataFrame(
+                {column: arrays[name]
+                 for column, name in ARCHIVE_COLUMNS.items()},
+                index=pd.DatetimeIndex(arrays['date']))
+            dates, columns = FrameColumns(pd.concat([older, stored]))
+            self.archive.rewrite(ticker, dates, columns, start=start)
+            self._forget(ticker)
+
+        stale = (time.time() - (self.archive.synced_at(ticker) or 0) >=
+                 self.max_staleness)
+        last_day = coverage[1]
+        if sync and stale and last_day is not None:
+            if last_day < np.datetime64(dt.now().date()):
+                try:
+                    dates, columns = FrameColumns(self.fetcher(
+                        ticker, pd.Timestamp(last_day) + timedelta(1),
+                        dt.now()))
+                    if self.archive.append(ticker, dates, columns):
+                        self._forget(ticker)
+                except Exception:
+                    logger.exception('Failed to update %s prices', ticker)
+            self.archive.mark_synced(ticker)
+
+    def read_arrays(self, ticker, start):
+        """Archived price history of the ticker since start, without
+        downloading
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param start: first day of the history
+        :type start: datetime
+        :raises KeyError: when the ticker is not archived
+        :return: 'date' plus one array per archive column
+        :rtype: dict
+        """
+        coverage = self.archive.coverage(ticker)
+        arrays = None if coverage is None else self._arrays(ticker, coverage)
+        if arrays is None:
+            raise KeyError(f'No price history archived for {ticker}')
+
+        first = np.searchsorted(arrays['date'],
+                                np.datetime64(pd.Timestamp(start).date()))
+
+        return {column: values[first:] for column, values in arrays.items()}
+
+    def invalidate(self, ticker):
+        """Forget the archived history of the ticker
+
+        :param ticker: stock ticker
+        :type ticker: str
+        """
+        self.archive.remove(ticker)
+        self._forget(ticker)
+
+
+price_store = PriceStore(
+    PriceArchive(os.path.join(CACHE_DIR, 'archive')),
+    max_memory=int(os.environ.get('PRICES_MAX_MEMORY', 64)),
+    max_staleness=int(os.environ.get('PRICES_MAX_STALENESS', 3600)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['update', 'compact'])
+    parser.add_argument('tickers', nargs='*')
+    parser.add_argument('--years', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    tickers = args.tickers
+    if not tickers and args.command == 'compact':
+        tickers = price_store.archive.tickers()
+    elif not tickers:
+        import utils
+        tickers = [item['value'] for item in utils.LoadTickers()]
+
+    start = pd.Timestamp(dt.now()) - pd.DateOffset(years=args.years)
+    for ticker in tickers:
+        try:
+            if args.command == 'update':
+                price_store.sync(ticker, start)
+            else:
+                price_store.archive.compact(ticker)
+            logger.info('%s %s', args.command, ticker)
+        except Exception:
+            logger.exception('Failed to %s %s', args.command, ticker)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Warning flag rules declared as data and evaluated on ticker panels.
+
+A rule is a dict, so it can come from a JSON file:
+
+    {"name": "roe_mean",
+     "metric": "ROE",
+     "aggregation": "mean",
+     "comparator": "<",
+     "threshold": 0.15,
+     "message": "A média do ROE é de {value:.2f}, menor que 0,15"}
+
+Every metric is a (tickers, rows) panel, the rows of each report left
+aligned as GetFiancialReport returns them (most recent year first) and
+padded with nan. Aggregations reduce the rows of each ticker ('mean',
+'latest', 'oldest', 'min', 'max', 'count') or compare each row with the
+previous year ('change'), in which case the message may name the flagged
+years with {years}. The threshold is a number or another metric with an
+optional factor, e.g. {"metric": "Net Income", "aggregation": "latest",
+"factor": 5}. A rule of the file with the name of a default one overrides
+its keys, e.g. {"name": "roe_mean", "enabled": false} turns it off.
+"""
+import json
+import operator
+
+import numpy as np
+
+
+AGGREGATIONS = ['mean', 'latest', 'oldest', 'min', 'max', 'count', 'change']
+
+COMPARATORS = {'<': operator.lt,
+               '<=': operator.le,
+               '>': operator.gt,
+               '>=': operator.ge,
+               '==': operator.eq,
+               '!=': operator.ne}
+
+DEFAULT_RULES = [
+    dict(name='eps_growth_slowdown',
+         metric='EPS Growth',
+         aggregation='change',
+         comparator='<',
+         threshold=0,
+         message='Há redução na taxa de crescimento em {years}'),
+    dict(name='roe_mean',
+         metric='ROE',
+         aggregation='mean',
+         comparator='<',
+         threshold=0.15,
+         message='A média do ROE é de {value:.2f}, menor que 0,15'),
+    dict(name='roa_mean',
+         metric='ROA',
+         aggregation='mean',
+         comparator='<',
+         threshold=0.07,
+         message='A média do ROA é de {value:.2f}, menor que 0,07'),
+    dict(name='long_term_debt',
+         metric='Total Long Term Debt',
+         aggregation='latest',
+         comparator='>',
+         threshold=dict(metric='Net Income', aggregation='latest', factor=5),
+         message='A Dívida de Longo Prazo maior que cinco vezes o Lucro '
+                 'Líquido.'),
+]
+
+
+def Aggregate(values, aggregation):
+    """Reduce the rows of a metric panel
+
+    :param values: metric panel, shape (tickers, rows)
+    :type values: numpy array
+    :param aggregation: one of AGGREGATIONS
+    :type aggregation: str
+    :return: shape (tickers,), or (tickers, rows) for 'change'
+    :rtype: numpy array
+    """
+    present = ~np.isnan(values)
+    tickers = np.arange(values.shape[0])
+
+    with np.errstate(invalid='ignore'):
+        if aggregation == 'change':
+            # each row against the one after it, the previous year
+            change = np.full(values.shape, np.nan)
+            change[:, :-1] = values[:, :-1] - values[:, 1:]
+            return change
+        if aggregation == 'latest':
+            return values[:, 0]
+        if aggregation == 'oldest':
+            last = values.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+            return values[tickers, last]
+        if aggregation == 'count':
+            return present.sum(axis=1).astype(float)
+
+        # nan for the tickers without any value, as np.nanmean would
+        count = present.sum(axis=1)
+        if aggregation == 'mean':
+            reduced = np.where(present, values, 0.).sum(axis=1) / count
+        elif aggregation == 'min':
+            reduced = np.where(present, values, np.inf).min(axis=1)
+        elif aggregation == 'max':
+            reduced = np.where(present, values, -np.inf).max(axis=1)
+
+    return np.where(count > 0, reduced, np.nan)
+
+
+def CompileRule(rule):
+    """Validate a rule and turn it into a function of the panel
+
+    :param rule: rule declaration, see the module docstring
+    :type rule: dict
+    :raises ValueError: for an unknown aggregation or comparator
+    :return: function returning the (tickers, rows) or (tickers,) mask of
+        the flagged cells and the aggregated values
+    :rtype: function
+    """
+    aggregation = rule.get('aggregation', 'latest')
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f'Unknown aggregation {aggregation!r} in rule '
+                         f'{rule.get("name")!r}')
+    comparator = COMPARATORS.get(rule.get('comparator'))
+    if comparator is None:
+        raise ValueError(f'Unknown comparator {rule.get("comparator")!r} in '
+                         f'rule {rule.get("name")!r}')
+    for key in ('metric', 'message'):
+        if key not in rule:
+            raise ValueError(f'Rule {rule.get("name")!r} has no {key}')
+
+    threshold = rule.get('threshold', 0)
+    if isinstance(threshold, dict):
+        if threshold.get('aggregation', 'latest') not in AGGREGATIONS:
+            raise ValueError(f'Unknown threshold aggregation in rule '
+                             f'{rule.get("name")!r}')
+
+    def Threshold(panel):
+        if not isinstance(threshold, dict):
+            return float(threshold)
+
+        values = Aggregate(panel[threshold['metric']],
+                           threshold.get('aggregation', 'latest'))
+        if values.ndim == 2 and aggregation != 'change':
+            raise ValueError(f'Rule {rule.get("name")!r} compares a total '
+                             f'against a yearly threshold')
+        return values * threshold.get('factor', 1)
+
+    def Evaluate(panel):
+        values = Aggregate(panel[rule['metric']], aggregation)
+        limit = Threshold(panel)
+        if np.ndim(limit) == 1 and values.ndim == 2:
+            limit = limit[:, None]
+
+        with np.errstate(invalid='ignore'):
+            # comparisons against nan are never flagged
+            return comparator(values, limit), values
+
+    return Evaluate
+
+
+def LoadRules(path=None):
+    """Default rules merged with the rules of a JSON file
+
+    :param path: JSON file with a list of rules, None for the defaults
+    :type path: str
+    :return: enabled rules, in order
+    :rtype: list
+    """
+    rules = [dict(rule) for rule in DEFAULT_RULES]
+    if path:
+        with open(path) as rules_file:
+            custom = json.load(rules_file)
+
+        names = [rule['name'] for rule in rules]
+        for rule in custom:
+            if rule.get('name') in names:
+                position = names.index(rule['name'])
+                rules[position] = dict(rules[position], **rule)
+            else:
+                rules.append(rule)
+                names.append(rule.get('name'))
+
+    rules = [rule for rule in rules if rule.get('enabled', True)]
+    for rule in rules:
+        CompileRule(rule)
+
+    return rules
+
+
+def RulesPanel(reports, metrics):
+    """Stack the reports of many tickers, rows left aligned
+
+    :param reports: fundamentals of each ticker, as from GetFiancialReport
+        or a dict of column lists
+    :type reports: list
+    :param metrics: columns to stack
+    :type metrics: list
+    :return: (tickers, rows) float panel of each metric
+    :rtype: dict
+    """
+    columns = [{metric: np.asarray(report[metric], dtype=float)
+                for metric in metrics} for report in reports]
+    rows = max([len(column[metrics[0]]) for column in columns] + [1])
+
+    panel = {}
+    for metric in metrics:
+        values = np.full((len(reports), rows), np.nan)
+        for ticker, column in enumerate(columns):
+            values[ticker, :len(column[metric])] = column[metric]
+        panel[metric] = values
+
+    return panel
+
+
+def RuleMetrics(rules):
+    """Every metric the rules read, plus 'Year' for the messages"""
+    metrics = ['Year']
+    for rule in rules:
+        metrics.append(rule['metric'])
+        if isinstance(rule.get('threshold'), dict):
+            metrics.append(rule['threshold']['metric'])
+
+    return sorted(set(metrics), key=metrics.index)
+
+
+def EvaluateRules(panel, rules):
+    """Warning flags of every ticker of the panel
+
+    :param panel: metric panels, as from RulesPanel, including 'Year'
+    :type panel: dict
+    :param rules: rules, as from LoadRules
+    :type rules: list
+    :return: [Warning Flags] of each ticker
+    :rtype: list
+    """
+    tickers = panel['Year'].shape[0]
+    reasons = [[] for _ in range(tickers)]
+
+    for rule in rules:
+        flagged, values = CompileRule(rule)(panel)
+
+        if flagged.ndim == 2:
+            for ticker in np.flatnonzero(flagged.any(axis=1)):
+                # years listed from the oldest
+                years = panel['Year'][ticker][flagged[ticker]][::-1]
+                reasons[ticker].append(dict(reason=rule['message'].format(
+                    years=''.join(f'{year:.0f}, ' for year in years))))
+        else:
+            for ticker in np.flatnonzero(flagged):
+                reasons[ticker].append(dict(reason=rule['message'].format(
+                    value=values[ticker])))
+
+    return reasons
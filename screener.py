@@ -0,0 +1,405 @@
+"""Market-wide screener over the whole B3 ticker universe.
+
+Usage: python screener.py [--workers 2] [--processes] [--retries 2]
+                          [--timeout 300] [--discount 0.2] [--margin 0.15]
+
+Every finished ticker is appended to a JSON lines checkpoint, so a crashed
+or interrupted run resumes where it stopped. The ranked table is written to
+a CSV file read by the /screener page of the dashboard.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+import numpy as np
+from cache import CACHE_DIR
+
+
+logger = logging.getLogger(__name__)
+
+SCREENER_CHECKPOINT = os.path.join(CACHE_DIR, 'screener.jsonl')
+SCREENER_RANKING = os.path.join(CACHE_DIR, 'screener.csv')
+
+RANKING_COLUMNS = ['ticker',
+                   'decision',
+                   'last_share_price',
+                   'margin_price',
+                   'margin_upside',
+                   'PV',
+                   'annual_growth_rate',
+                   'pe_ratio',
+                   'roe_mean',
+                   'roa_mean',
+                   'roe_flag',
+                   'roa_flag',
+                   'alerts',
+                   'reasons']
+
+
+def ScreenTicker(ticker, discount_rate, margin_rate):
+    """Fetch the ticker data and run the warning flags and the valuation
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :param discount_rate: expected annual return
+    :type discount_rate: float
+    :param margin_rate: margin of safety
+    :type margin_rate: float
+    :return: one row of the ranking
+    :rtype: dict
+    """
+    # imported here so the CLI starts without loading selenium per process
+    import utils
+
+    fundamentals = utils.GetFiancialReport(ticker)
+    utils.GetPriceHistory(ticker)
+
+    columns = utils.FundamentalsArrays(fundamentals)
+    reasons = utils.CheckWarningFlags(fundamentals)
+    pricing = utils.FuturePricing(ticker, fundamentals,
+                                  discount_rate, margin_rate)[0]
+
+    roe_mean = float(np.nanmean(columns['ROE']))
+    roa_mean = float(np.nanmean(columns['ROA']))
+    margin_price = float(pricing['margin_price'])
+    last_share_price = float(pricing['last_share_price'])
+
+    return dict(ticker=ticker,
+                decision=pricing['decision'],
+                last_share_price=last_share_price,
+                margin_price=margin_price,
+                margin_upside=(margin_price / last_share_price - 1
+                               if last_share_price else float('nan')),
+                PV=float(pricing['PV']),
+                annual_growth_rate=float(pricing['annual_growth_rate']),
+                pe_ratio=float(pricing['pe_ratio']),
+                roe_mean=roe_mean,
+                roa_mean=roa_mean,
+                roe_flag=bool(roe_mean < 0.15),
+                roa_flag=bool(roa_mean < 0.07),
+                alerts=len(reasons),
+                reasons=' | '.join(item['reason'] for item in reasons))
+
+
+def ScreenTickerWithRetries(ticker, discount_rate, margin_rate, retries):
+    """ScreenTicker with exponential backoff between failed attempts
+
+    :return: ranking row, or a row with the error of the last attempt
+    :rtype: dict
+    """
+    for attempt in range(retries + 1):
+        try:
+            return ScreenTicker(ticker, discount_rate, margin_rate)
+        except Exception as error:
+            if attempt == retries:
+                return dict(ticker=ticker, error=repr(error))
+            time.sleep(2 ** attempt)
+
+
+class _ThreadTask(object):
+    """A ticker screened on the thread pool.
+
+    A running thread cannot be stopped: a hung ticker is given up but keeps
+    its thread until the urllib3, page load and Yahoo timeouts end it.
+    """
+
+    def __init__(self, executor, ticker, *args):
+        self.ticker = ticker
+        self.future = executor.submit(ScreenTickerWithRetries, ticker, *args)
+        self.started = None
+
+    def done(self):
+        # the timeout clock starts when a thread picks the ticker up
+        if self.started is None and (self.future.running() or
+                                     self.future.done()):
+            self.started = time.time()
+        return self.future.done()
+
+    def result(self):
+        try:
+            return self.future.result()
+        except Exception as error:
+            return dict(ticker=self.ticker, error=repr(error))
+
+    def kill(self):
+        self.future.cancel()
+
+
+def _ScreenInProcess(connection, ticker, *args):
+    # own process group, so a timeout also kills the browsers started here
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    try:
+        connection.send(ScreenTickerWithRetries(ticker, *args))
+        connection.close()
+    finally:
+        # the child exits without running atexit, quit the browsers here
+        import utils
+        utils.driver_pool.close()
+
+
+class _ProcessTask(object):
+    """A ticker screened on its own child process, killed on timeout along
+    with the browsers it started"""
+
+    def __init__(self, ticker, *args):
+        self.ticker = ticker
+        self.connection, child_connection = multiprocessing.Pipe(False)
+        self.process = multiprocessing.Process(
+            target=_ScreenInProcess, args=(child_connection, ticker) + args,
+            daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.started = time.time()
+
+    def done(self):
+        return self.connection.poll() or not self.process.is_alive()
+
+    def result(self):
+        try:
+            row = self.connection.recv()
+        except (EOFError, OSError):
+            row = dict(ticker=self.ticker, error='process exited with code '
+                                                 f'{self.process.exitcode}')
+        self.process.join()
+        self.connection.close()
+        return row
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (AttributeError, OSError):
+            # no process groups, or the child has not created its own yet
+            self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+def LoadCheckpoint(path):
+    """Rows already screened, keyed by ticker
+
+    :param path: JSON lines checkpoint
+    :type path: str
+    :rtype: dict
+    """
+    done = {}
+    try:
+        with open(path) as checkpoint:
+            for line in checkpoint:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # last line of a run killed while writing
+                    continue
+                done[row['ticker']] = row
+    except OSError:
+        pass
+
+    return done
+
+
+def WriteRanking(rows, path):
+    """Write the successful rows sorted by margin upside
+
+    :param rows: ranking rows
+    :type rows: list
+    :param path: CSV file
+    :type path: str
+    """
+    def Upside(row):
+        upside = row['margin_upside']
+        return -np.inf if np.isnan(upside) else upside
+
+    ranked = sorted((row for row in rows if 'error' not in row),
+                    key=Upside, reverse=True)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', newline='') as ranking:
+        writer = csv.DictWriter(ranking, fieldnames=RANKING_COLUMNS,
+                                extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(ranked)
+    os.replace(temp_path, path)
+
+
+def LoadRanking(path=SCREENER_RANKING):
+    """Ranking written by the last screener run
+
+    :return: rows for a Dash DataTable
+    :rtype: list
+    """
+    numeric = RANKING_COLUMNS[2:10] + ['alerts']
+    try:
+        with open(path, newline='') as ranking:
+            rows = list(csv.DictReader(ranking))
+    except OSError:
+        return []
+
+    for row in rows:
+        for column in numeric:
+            row[column] = float(row[column])
+
+    return rows
+
+
+def RunScreener(tickers, discount_rate=0.2, margin_rate=0.15, workers=2,
+                processes=False, retries=2, timeout=300,
+                checkpoint=SCREENER_CHECKPOINT, output=SCREENER_RANKING,
+                retry_failed=False):
+    """Screen every ticker with a bounded pool and write the ranking
+
+    :param tickers: stock tickers
+    :type tickers: list
+    :param workers: tickers screened at the same time
+    :type workers: int
+    :param processes: screen each ticker on a child process, which is
+        terminated when it times out, instead of a thread pool
+    :type processes: bool
+    :param retries: extra attempts for a failing ticker
+    :type retries: int
+    :param timeout: seconds a ticker may run before being given up,
+        counted from the moment it starts, not from when it is queued
+    :type timeout: float
+    :param retry_failed: screen again the tickers that failed on a
+        previous run
+    :type retry_failed: bool
+    :return: every row of the run, including the resumed ones
+    :rtype: list
+    """
+    # rows of a previous run with other rates are screened again
+    done = {ticker: row
+            for ticker, row in LoadCheckpoint(checkpoint).items()
+            if row.get('discount_rate') == discount_rate
+            and row.get('margin_rate') == margin_rate
+            and not (retry_failed and 'error' in row)}
+    pending_tickers = [ticker for ticker in tickers if ticker not in done]
+
+    logger.info('%d tickers, %d resumed from checkpoint, %d to screen',
+                len(tickers), len(tickers) - len(pending_tickers),
+                len(pending_tickers))
+
+    executor = None if processes else ThreadPoolExecutor(max_workers=workers)
+    os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+
+    started = time.time()
+    finished = 0
+    running = []
+    queue = iter(pending_tickers)
+
+    with open(checkpoint, 'a') as checkpoint_file:
+        def Record(row):
+            row.update(discount_rate=discount_rate, margin_rate=margin_rate)
+            checkpoint_file.write(json.dumps(row) + '\n')
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+            done[row['ticker']] = row
+
+        try:
+            while True:
+                while len(running) < workers:
+                    ticker = next(queue, None)
+                    if ticker is None:
+                        break
+                    args = (ticker, discount_rate, margin_rate, retries)
+                    running.append(_ProcessTask(*args) if processes
+                                   else _ThreadTask(executor, *args))
+
+                if not running:
+                    break
+
+                progressed = False
+                for task in list(running):
+                    if task.done():
+                        row = task.result()
+                    elif (task.started is not None and
+                          time.time() - task.started > timeout):
+                        task.kill()
+                        row = dict(ticker=task.ticker, error='timeout')
+                    else:
+                        continue
+
+                    running.remove(task)
+                    Record(row)
+                    finished += 1
+                    progressed = True
+
+                    elapsed = time.time() - started
+                    logger.info('[%d/%d] %s %s (%.1f tickers/min)',
+                                finished, len(pending_tickers), task.ticker,
+                                row.get('error', row.get('decision')),
+                                finished / elapsed * 60)
+
+                if not progressed:
+                    time.sleep(0.2)
+        finally:
+            for task in running:
+                task.kill()
+            if executor is not None:
+                # the threads still running are joined at exit, bounded by
+                # the network timeouts of the scrap
+                executor.shutdown(wait=False)
+
+    rows = [done[ticker] for ticker in tickers if ticker in done]
+    WriteRanking(rows, output)
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('tickers', nargs='*',
+                        help='tickers to screen, defaults to every B3 ticker')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--processes', action='store_true',
+                        help='screen each ticker on a child process that is '
+                             'killed on timeout, instead of threads')
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--discount', type=float, default=0.2)
+    parser.add_argument('--margin', type=float, default=0.15)
+    parser.add_argument('--checkpoint', default=SCREENER_CHECKPOINT)
+    parser.add_argument('--output', default=SCREENER_RANKING)
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the checkpoint of a previous run')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='screen again the tickers that failed before')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    tickers = args.tickers
+    if not tickers:
+        import utils
+        tickers = [item['value']
+                   for item in (utils.LoadTickers() or utils.GetTickers())]
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    started = time.time()
+    rows = RunScreener(tickers,
+                       discount_rate=args.discount,
+                       margin_rate=args.margin,
+                       workers=args.workers,
+                       processes=args.processes,
+                       retries=args.retries,
+                       timeout=args.timeout,
+                       checkpoint=args.checkpoint,
+                       output=args.output,
+                       retry_failed=args.retry_failed)
+
+    failed = sum('error' in row for row in rows)
+    logger.info('%d tickers screened, %d failed, in %.0fs. Ranking at %s',
+                len(rows), failed, time.time() - started, args.output)
+
+
+if __name__ == '__main__':
+    main()
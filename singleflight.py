@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, threads are still coalesced
+    fcntl = None
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key into a single call.
+
+    Threads of a worker asking for a key already being fetched wait for that
+    fetch and share its result or its exception. Across gunicorn workers the
+    fetch runs while holding a lock file, so the other workers block until it
+    finishes; their function should then find the result on the shared disk
+    cache instead of fetching it again.
+    """
+
+    def __init__(self, lock_dir=None):
+        """
+        :param lock_dir: folder of the lock files, None to coalesce only
+            the threads of this process
+        :type lock_dir: str
+        """
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._calls = {}
+
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, func):
+        """Call func, unless a call for key is in flight, then wait for it
+
+        :param key: identifies the fetch
+        :type key: str
+        :param func: callable without arguments
+        :type func: function
+        :return: result of func
+        :rtype: object
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self._file_lock(key):
+                call.result = func()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    @contextmanager
+    def _file_lock(self, key):
+        if not self.lock_dir or fcntl is None:
+            yield
+            return
+
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock'
+        with open(os.path.join(self.lock_dir, name), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def in_flight(self):
+        """Keys being fetched by this process and how many callers wait
+
+        :return: number of waiters by key
+        :rtype: dict
+        """
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
@@ -0,0 +1,249 @@
+from contextlib import contextmanager
+from datetime import datetime as dt
+import json
+import math
+import os
+import sqlite3
+import time
+
+import pandas as pd
+from cache import CACHE_DIR
+
+
+def ExpectedFiscalYear(now=None, publish_month=4):
+    """Most recent fiscal year whose annual statements should be out
+
+    :param now: reference date, defaults to today
+    :type now: datetime
+    :param publish_month: month by which the companies have published the
+        statements of the previous year
+    :type publish_month: int
+    :rtype: int
+    """
+    now = now or dt.now()
+    return now.year - 1 if now.month >= publish_month else now.year - 2
+
+
+def _Same(old, new):
+    """Whether two archived rows hold the same values, nan equal to nan"""
+    if set(old) != set(new):
+        return False
+    for column, value in new.items():
+        other = old[column]
+        if value is None or other is None:
+            if value is not other:
+                return False
+        elif not math.isclose(value, other, rel_tol=1e-9, abs_tol=1e-12):
+            return False
+    return True
+
+
+class FundamentalsArchive(object):
+    """Append-only archive of the annual statements of every ticker.
+
+    Each scrap is merged by fiscal year into a local SQLite file: new years
+    are added, unchanged years are skipped and a year whose values changed
+    (a restatement) gets a new version, older versions being kept. Reads
+    return the latest version of each year, or the one known at a given
+    time, so the history grows past the five years shown by Reuters.
+    """
+
+    def __init__(self, path, publish_month=4, retry_interval=24 * 3600):
+        """
+        :param path: path of the SQLite file
+        :type path: str
+        :param publish_month: see ExpectedFiscalYear
+        :type publish_month: int
+        :param retry_interval: seconds between scraps while an expected
+            fiscal year is not published yet
+        :type retry_interval: int
+        """
+        self.path = path
+        self.publish_month = publish_month
+        self.retry_interval = retry_interval
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS statements ('
+                         'ticker TEXT NOT NULL, '
+                         'year INTEGER NOT NULL, '
+                         'version INTEGER NOT NULL, '
+                         'scraped_at REAL NOT NULL, '
+                         'data TEXT NOT NULL, '
+                         'PRIMARY KEY (ticker, year, version))')
+            conn.execute('CREATE TABLE IF NOT EXISTS scraps ('
+                         'ticker TEXT PRIMARY KEY, '
+                         'scraped_at REAL NOT NULL)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def merge(self, ticker, report, scraped_at=None):
+        """Merge a scrapped report into the archive
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param report: one row per fiscal year with a 'Year' column and
+            the raw statement values, as from ScrapStatements
+        :type report: pandas dataframe
+        :param scraped_at: timestamp of the scrap, defaults to now
+        :type scraped_at: float
+        :return: number of years added and restated
+        :rtype: dict
+        """
+        scraped_at = time.time() if scraped_at is None else scraped_at
+        added = restated = 0
+
+        rows = []
+        for record in report.to_dict('records'):
+            year = int(record.pop('Year'))
+            rows.append((year, {column: (None if pd.isnull(value)
+                                         else float(value))
+                                for column, value in record.items()}))
+
+        with self._connect() as conn:
+            # serialize the writers of every worker
+            conn.execute('BEGIN IMMEDIATE')
+            for year, data in rows:
+                latest = conn.execute(
+                    'SELECT version, data FROM statements '
+                    'WHERE ticker = ? AND year = ? '
+                    'ORDER BY version DESC LIMIT 1',
+                    (ticker, year)).fetchone()
+                if latest is not None and _Same(json.loads(latest[1]), data):
+                    continue
+
+                conn.execute('INSERT INTO statements VALUES (?, ?, ?, ?, ?)',
+                             (ticker, year, latest[0] + 1 if latest else 1,
+                              scraped_at, json.dumps(data)))
+                if latest is None:
+                    added += 1
+                else:
+                    restated += 1
+
+            conn.execute('INSERT OR REPLACE INTO scraps VALUES (?, ?)',
+                         (ticker, scraped_at))
+
+        return dict(added=added, restated=restated)
+
+    def read(self, ticker, start=None, end=None, as_of=None):
+        """Latest version of each fiscal year between start and end
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param start: first fiscal year, None for the oldest
+        :type start: int
+        :param end: last fiscal year, None for the most recent
+        :type end: int
+        :param as_of: timestamp, only the versions scrapped until then
+        :type as_of: float
+        :return: one row per fiscal year, most recent first, None when
+            nothing is archived
+        :rtype: pandas dataframe
+        """
+        rows = self._query(
+            'SELECT year, data FROM statements WHERE ticker = ? '
+            'AND year >= ? AND year <= ? AND scraped_at <= ? '
+            'ORDER BY year DESC, version ASC',
+            (ticker,
+             -1 if start is None else int(start),
+             9999 if end is None else int(end),
+             math.inf if as_of is None else as_of))
+        if not rows:
+            return None
+
+        # the last version of each year wins
+        latest = {}
+        for year, data in rows:
+            latest[year] = json.loads(data)
+
+        report = pd.DataFrame([dict(data, Year=year)
+                               for year, data in latest.items()])
+        columns = ['Year'] + [column for column in report.columns
+                              if column != 'Year']
+
+        return report.loc[:, columns].astype(float).astype({'Year': int})
+
+    def versions(self, ticker, year):
+        """Every archived version of a fiscal year, oldest first
+
+        :return: version, scraped_at and values of each version
+        :rtype: list
+        """
+        return [dict(version=version, scraped_at=scraped_at,
+                     data=json.loads(data))
+                for version, scraped_at, data in self._query(
+                    'SELECT version, scraped_at, data FROM statements '
+                    'WHERE ticker = ? AND year = ? ORDER BY version',
+                    (ticker, int(year)))]
+
+    def years(self, ticker):
+        """First and last archived fiscal years, None when not archived
+
+        :rtype: tuple
+        """
+        first, last = self._query('SELECT MIN(year), MAX(year) FROM '
+                                  'statements WHERE ticker = ?',
+                                  (ticker,))[0]
+        return None if first is None else (first, last)
+
+    def needs_scrap(self, ticker, now=None):
+        """Whether Reuters may have a fiscal year the archive lacks
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :param now: reference date, defaults to today
+        :type now: datetime
+        :rtype: bool
+        """
+        now = now or dt.now()
+        years = self.years(ticker)
+        if years is None:
+            return True
+        if years[1] >= ExpectedFiscalYear(now, self.publish_month):
+            return False
+
+        scraped_at = self.scraped_at(ticker)
+        return (scraped_at is None or
+                now.timestamp() - scraped_at >= self.retry_interval)
+
+    def scraped_at(self, ticker):
+        """Time of the last scrap merged for the ticker
+
+        :param ticker: stock ticker
+        :type ticker: str
+        :return: timestamp, None when never scrapped
+        :rtype: float
+        """
+        rows = self._query('SELECT scraped_at FROM scraps WHERE ticker = ?',
+                           (ticker,))
+        return rows[0][0] if rows else None
+
+    def tickers(self):
+        """Every archived ticker
+
+        :rtype: list
+        """
+        return [ticker for ticker, in self._query(
+            'SELECT DISTINCT ticker FROM statements ORDER BY ticker')]
+
+    def _query(self, sql, params=()):
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+
+fundamentals_archive = FundamentalsArchive(
+    os.path.join(CACHE_DIR, 'statements.sqlite'),
+    publish_month=int(os.environ.get('FUNDAMENTALS_PUBLISH_MONTH', 4)),
+    retry_interval=int(os.environ.get('FUNDAMENTALS_RETRY_INTERVAL',
+                                      24 * 3600)))
@@ -1,136 +1,206 @@
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
+import json
+import logging
 import os
+import threading
+import time
 import urllib3
 import certifi
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
 import pandas as pd
 import numpy as np
-import pandas_datareader as dr
 from dateutil.relativedelta import relativedelta
+from cache import CACHE_DIR, fundamentals_cache
+from driverpool import WebDriverPool
+from metrics import registry
+from archive import FirstCloseByYear
+from prices import HistoryFrame, price_store
+from rules import EvaluateRules, LoadRules, RuleMetrics, RulesPanel
+from singleflight import SingleFlight
+from statements import fundamentals_archive
+from valuation import (BatchFuturePricing, BatchMarginPricing,
+                       MinPriceEarnings)
 
 
-def GetTickers():
-    """Scrap the B3 stock tickers from Yahoo Finanças
+logger = logging.getLogger(__name__)
+
+
+# concurrent fetches of the same ticker, within and across workers
+inflight = SingleFlight(os.path.join(CACHE_DIR, 'locks'))
+
+# Constants used
+B3_INDUSTRIES = ['Energia-Petroleo-Gas',
+                 'Industria-Financeira',
+                 'Saude-Farmaceutica',
+                 'Telecomunicacoes-Tecnologia',
+                 'Industria-Alimenticia',
+                 'Industria-Manufatureira',
+                 'Servicos-diversos',
+                 'Varejo',
+                 'Construcao-Equipamentos',
+                 'Bens-de-consumo',
+                 'Industrias-em-geral']
+
+YAHOO_FINANCE_URL = os.environ.get('YAHOO_FINANCE_URL',
+                                   'https://br.financas.yahoo.com/industries/')
+
+REUTERS_URL = os.environ.get('REUTERS_URL',
+                             'https://www.reuters.com/companies/')
+
+# set to 0 to always load the Reuters statements on the headless browser
+REUTERS_HTTP_FETCH = os.environ.get('REUTERS_HTTP_FETCH', '1') != '0'
+
+# the plain HTTP fetch is sent as a regular browser would
+REUTERS_HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (X11; Linux x86_64; rv:68.0) '
+                   'Gecko/20100101 Firefox/68.0'),
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en-US,en;q=0.5'}
+
+# default warning flags plus the ones of the WARNING_RULES json file
+WARNING_RULES = LoadRules(os.environ.get('WARNING_RULES'))
+
+TICKERS_SNAPSHOT = os.path.join(CACHE_DIR, 'tickers.json')
+
+TICKERS_REFRESH_INTERVAL = int(os.environ.get('TICKERS_REFRESH_INTERVAL',
+                                              24 * 3600))
 
+# urllib3 pools are thread safe, so a single manager serves every request
+http_pool = urllib3.PoolManager(cert_reqs='CERT_REQUIRED',
+                                ca_certs=certifi.where(),
+                                maxsize=len(B3_INDUSTRIES))
+
+
+def ScrapIndustryTickers(industry):
+    """Scrap the tickers of one industry page from Yahoo Finanças
+
+    :param industry: industry name as in the Yahoo url
+    :type industry: str
     :return: [list of dictionaries for Dash dcc.dropdown]
     :rtype: [list]
     """
-    # Constants used
-    b3Industries = ['Energia-Petroleo-Gas',
-                    'Industria-Financeira',
-                    'Saude-Farmaceutica',
-                    'Telecomunicacoes-Tecnologia',
-                    'Industria-Alimenticia',
-                    'Industria-Manufatureira',
-                    'Servicos-diversos',
-                    'Varejo',
-                    'Construcao-Equipamentos',
-                    'Bens-de-consumo',
-                    'Industrias-em-geral']
-
-    yahooFinanceUrl = 'https://br.financas.yahoo.com/industries/'
+    # scraping libraries are imported on first use, for a fast startup
+    from bs4 import BeautifulSoup
+
+    stockInfo = []
 
+    page = http_pool.request('GET', YAHOO_FINANCE_URL + industry)
+    page_html = BeautifulSoup(page.data, 'lxml')
+    for search in page_html.select(r"tbody a.Fw\(b\)"):
+        if search['data-symbol'] != search['title']:
+            stockInfo.append({'value': search['data-symbol'],
+                              'label': (
+                                  search['data-symbol'] +
+                                  ' | ' + search['title'])
+                              })
+
+    return stockInfo
+
+
+def GetTickers():
+    """Scrap the B3 stock tickers from Yahoo Finanças, fetching every
+    industry page concurrently, and save them on the tickers snapshot
+
+    :return: [list of dictionaries for Dash dcc.dropdown]
+    :rtype: [list]
+    """
     # List to store the dropdown menu values
     stockInfo = []
 
-    http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED',
-                               ca_certs=certifi.where())
+    with registry.timer('get_tickers'), \
+            ThreadPoolExecutor(max_workers=len(B3_INDUSTRIES)) as executor:
+        for industry_info in executor.map(ScrapIndustryTickers,
+                                          B3_INDUSTRIES):
+            stockInfo += industry_info
 
-    for industry in b3Industries:
-        page = http.request('GET', yahooFinanceUrl+industry)
-        page_html = BeautifulSoup(page.data, 'lxml')
-        for search in page_html.select(r"tbody a.Fw\(b\)"):
-            if search['data-symbol'] != search['title']:
-                stockInfo.append({'value': search['data-symbol'],
-                                  'label': (
-                                      search['data-symbol'] +
-                                      ' | ' + search['title'])
-                                  })
+    SaveTickersSnapshot(stockInfo)
 
     return stockInfo
 
 
-def ScrapTableValues(key_perf_indicator, driver, url):
-    """The function opens the webpage and loop for the metric selected
+def SaveTickersSnapshot(stockInfo):
+    """Atomically write the dropdown options on the snapshot file
 
-    :param key_perf_indicator: metric to be found on the table
-    :type key_perf_indicator: str
-    :param driver: selenium webdriver
-    :type driver: object
-    :param url: url of page to be scrapped
-    :type url: str
-    :return: key value pair tuple on a list
-    :rtype: list
+    :param stockInfo: [list of dictionaries for Dash dcc.dropdown]
+    :type stockInfo: [list]
     """
-    kpi_data = []
-    try:
-        driver.get(url)
-        WebDriverWait(driver, 15).until(EC.visibility_of_element_located(
-            (By.XPATH,
-             '//*[@id="__next"]/div/div[4]/div[1]/div/div/section/div[2]\
-             /div[3]')))
+    os.makedirs(os.path.dirname(TICKERS_SNAPSHOT), exist_ok=True)
+    temp_path = f'{TICKERS_SNAPSHOT}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as snapshot:
+        json.dump(stockInfo, snapshot)
+    os.replace(temp_path, TICKERS_SNAPSHOT)
 
-        for index, kpi in enumerate(driver.find_elements_by_tag_name('tr th span'), start=1):
-            if kpi.text == key_perf_indicator:
-                for column in range(1, 6):
-                    for value in driver.find_elements_by_xpath(f'//*[@id="__next"]/div/div[4]/div[1]/div/div/section/div[2]/div[3]/table/tbody/tr[{index}]/td[{column}]'):
-                        try:
-                            kpi_data.append(
-                                (kpi.text, float(value.text.replace(',', ''))))
-                        except ValueError:
-                            try:
-                                kpi_data.append((kpi.text, float(value.text.strip('()').replace(',', '')) * (-1)))
-                            except ValueError:
-                                kpi_data.append((kpi.text, 0))
 
-    except TimeoutException:
-        driver.quit()
+def LoadTickers():
+    """Read the dropdown options from the snapshot, without any network call
 
-    return kpi_data
+    :return: [list of dictionaries for Dash dcc.dropdown]
+    :rtype: [list]
+    """
+    try:
+        with open(TICKERS_SNAPSHOT) as snapshot:
+            return json.load(snapshot)
+    except (OSError, ValueError):
+        return []
 
 
-def GetFiancialReport(ticker):
-    """Scrap the financial data from Reuters webpage
+def TickersSnapshotAge():
+    """Seconds since the snapshot was written, None when it does not exist
 
-    :param ticker: stock ticker
-    :type ticker: str
-    :return: dataframe with all data gathered
-    :rtype: pandas dataframe
+    :rtype: float
     """
-    # #checking environment:
-    is_prod = os.environ.get('IS_HEROKU', None)
-
-    income_stat_annual = ['Net Income',
-                          'Interest Exp.(Inc.),Net-Operating, Total',
-                          'Diluted Normalized EPS',
-                          'Net Income Before Taxes']
+    try:
+        return time.time() - os.path.getmtime(TICKERS_SNAPSHOT)
+    except OSError:
+        return None
 
-    balance_sheet_anual = ['Total Assets',
-                           'Total Long Term Debt',
-                           'Total Liabilities',
-                           "Total Liabilities & Shareholders' Equity"]
 
-    reuters_income_url = ('https://www.reuters.com/companies/' +
-                          ticker + '/financials/' + 'income-statement-annual')
+def StartTickersRefresher(interval=TICKERS_REFRESH_INTERVAL):
+    """Refresh the tickers snapshot on a daemon thread every interval
+    seconds. A snapshot written recently by another worker is kept.
 
-    reuters_balance_url = ('https://www.reuters.com/companies/' +
-                           ticker + '/financials/' + 'balance-sheet-annual')
+    :param interval: seconds between refreshes
+    :type interval: int
+    :return: refresher thread
+    :rtype: threading.Thread
+    """
+    def Refresh():
+        while True:
+            age = TickersSnapshotAge()
+            if age is None or age >= interval:
+                try:
+                    GetTickers()
+                    age = 0
+                except Exception:
+                    logger.exception('Failed to refresh the tickers snapshot')
+                    age = interval - 300
+            time.sleep(max(interval - age, 60))
+
+    thread = threading.Thread(target=Refresh, name='tickers-refresher',
+                              daemon=True)
+    thread.start()
+
+    return thread
+
+
+@registry.timed('browser_launch')
+def CreateWebDriver():
+    """Start the headless browser matching the environment
+
+    :return: selenium webdriver
+    :rtype: object
+    """
+    from selenium import webdriver
 
-    data_scrapped = defaultdict(list)
-    kpi_data = []
-    column_year = []
+    # #checking environment:
+    is_prod = os.environ.get('IS_HEROKU', None)
 
     # applying the correct webdriver to the env
     if is_prod:
         GOOGLE_CHROME_PATH = '/app/.apt/usr/bin/google-chrome'
 
         chrome_options = webdriver.ChromeOptions()
+        chrome_options.add_argument('--headless')
         chrome_options.add_argument('--disable-gpu')
         chrome_options.add_argument('--no-sandbox')
         chrome_options.binary_location = GOOGLE_CHROME_PATH
@@ -142,50 +212,349 @@ def GetFiancialReport(ticker):
 
         driver = webdriver.Firefox(
             options=firefox_options,
-            executable_path="/home/rafael/projetos/dash/geckodriver")
+            executable_path=os.environ.get(
+                'GECKODRIVER_PATH',
+                "/home/rafael/projetos/dash/geckodriver"))
+
+    # a hung page load raises TimeoutException instead of blocking forever
+    driver.set_page_load_timeout(
+        int(os.environ.get('WEBDRIVER_PAGE_TIMEOUT', 30)))
+
+    return driver
+
+
+driver_pool = WebDriverPool(
+    CreateWebDriver,
+    max_size=int(os.environ.get('WEBDRIVER_POOL_SIZE', 2)),
+    max_pages=int(os.environ.get('WEBDRIVER_MAX_PAGES', 50)),
+    checkout_timeout=int(os.environ.get('WEBDRIVER_CHECKOUT_TIMEOUT', 120)))
+
+
+def _CacheCounters():
+    stats = fundamentals_cache.stats()
+    return [(dict(result='hit'), stats['hits']),
+            (dict(result='miss'), stats['misses'])]
+
+
+registry.register('b3_fundamentals_cache_requests_total', 'counter',
+                  'Fundamentals cache lookups of this process',
+                  _CacheCounters)
+registry.register('b3_fundamentals_cache_entries', 'gauge',
+                  'Reports stored on the fundamentals cache',
+                  lambda: [({}, fundamentals_cache.stats()['entries'])])
+registry.register('b3_webdriver_pool', 'gauge',
+                  'Browsers of the webdriver pool by state',
+                  lambda: [(dict(state=state), value)
+                           for state, value in driver_pool.stats().items()])
+registry.register('b3_inflight_fetches', 'gauge',
+                  'Fetches running in this process and their callers',
+                  lambda: [(dict(kind='fetches'), len(inflight.in_flight())),
+                           (dict(kind='waiters'),
+                            sum(inflight.in_flight().values()))])
+
+
+def ParseNumber(text):
+    """Convert a Reuters table cell to float, parenthesised values are
+    negative and anything else that is not a number becomes 0
+
+    :param text: cell text
+    :type text: str
+    :return: cell value
+    :rtype: float
+    """
+    text = text.strip().replace(',', '')
+    try:
+        return float(text)
+    except ValueError:
+        try:
+            return float(text.strip('()')) * (-1)
+        except ValueError:
+            return 0.
+
+
+def ParseStatementTable(page_source):
+    """Parse the whole financial statement table of a Reuters page at once
+
+    :param page_source: html of the statement page
+    :type page_source: str
+    :raises ValueError: when the page is not html or has no statement table
+    :return: every metric of the table (rows) by fiscal year (columns)
+    :rtype: pandas dataframe
+    """
+    import lxml.etree
+    import lxml.html
 
     try:
-        driver.get(reuters_income_url)
+        page_html = lxml.html.fromstring(page_source)
+    except lxml.etree.LxmlError as error:
+        # e.g. an empty body, the caller falls back to the browser
+        raise ValueError(f'Statement page could not be parsed: {error!r}')
+    tables = page_html.xpath('//table[thead//time]')
+    if not tables:
+        raise ValueError('Financial statement table not found')
+    table = tables[0]
+
+    years = [dt.strptime(item.text_content().strip(), '%d-%b-%y').year
+             for item in table.xpath('./thead//th//time')]
+
+    labels = []
+    values = []
+    for row in table.xpath('./tbody/tr'):
+        header = row.xpath('./th')
+        if not header:
+            continue
+        labels.append(header[0].text_content().strip())
+        values.append([ParseNumber(cell.text_content())
+                       for cell in row.xpath('./td')[:len(years)]])
+
+    statement_df = pd.DataFrame(values, index=labels,
+                                columns=years, dtype=float)
+
+    return statement_df[~statement_df.index.duplicated()]
+
+
+def ScrapStatementTable(driver, url):
+    """Load a Reuters statement page once and parse its table
+
+    :param driver: selenium webdriver
+    :type driver: object
+    :param url: url of page to be scrapped
+    :type url: str
+    :return: every metric of the table (rows) by fiscal year (columns)
+    :rtype: pandas dataframe
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # a TimeoutException propagates so the pool recycles the browser
+    with registry.timer('page_load', url=url):
+        driver.get(url)
         WebDriverWait(driver, 15).until(EC.visibility_of_element_located(
             (By.XPATH,
              '//*[@id="__next"]/div/div[4]/div[1]/div/div/section/div[2]\
              /div[3]')))
 
-        for year in range(2, 7):
-            column_year.append(driver.find_element_by_xpath(
-                f'//*[@id="__next"]/div/div[4]/div[1]/div/div/section/div[2]\
-                /div[3]/table/thead/tr/th[{year}]/time').text)
+    with registry.timer('parse_statement', url=url):
+        return ParseStatementTable(driver.page_source)
 
-        for item in income_stat_annual:
-            kpi_data += ScrapTableValues(item, driver, reuters_income_url)
 
-        for item in balance_sheet_anual:
-            kpi_data += ScrapTableValues(item, driver, reuters_balance_url)
+def FetchStatementTable(url):
+    """Download a Reuters statement page without a browser and parse its
+    table, which is already on the server rendered html
+
+    :param url: url of page to be scrapped
+    :type url: str
+    :raises ValueError: when the page has no statement table
+    :return: every metric of the table (rows) by fiscal year (columns)
+    :rtype: pandas dataframe
+    """
+    with registry.timer('http_statement', url=url):
+        page = http_pool.request('GET', url, headers=REUTERS_HEADERS,
+                                 timeout=urllib3.Timeout(connect=5, read=15),
+                                 retries=urllib3.Retry(2, backoff_factor=0.5))
+    if page.status != 200:
+        raise ValueError(f'{url} answered HTTP {page.status}')
 
-    finally:
-        driver.quit()
+    with registry.timer('parse_statement', url=url):
+        return ParseStatementTable(page.data.decode('utf-8', 'replace'))
 
-    # transforming the column_year in a datetime object
-    column_year = [('Year', dt.strptime(item, '%d-%b-%y').year) for item in column_year]
 
-    kpi_data += column_year
+FUNDAMENTALS_COLUMNS = ['Year',
+                        'Diluted Normalized EPS',
+                        'EPS Growth',
+                        'Net Income',
+                        'Shareholders Equity',
+                        'ROA',
+                        'Total Long Term Debt',
+                        'EBIT',
+                        'ROE']
 
-    # creating a defaultdict from the kpi_data list
-    for key, value in kpi_data:
-        data_scrapped[key].append(value)
+# bumped whenever the cached report changes shape or types
+FUNDAMENTALS_SCHEMA = 3
 
-    data_scrapped_df = pd.DataFrame.from_dict(data_scrapped,
-                                              orient='columns')
 
-    data_scrapped_df['EPS Growth'] = data_scrapped_df['Diluted Normalized EPS'].pct_change(-1).fillna(0).astype(float).map('{:.2%}'.format)
+def GetFiancialReport(ticker, refresh=False, rescrap=False):
+    """Get the financial data of the ticker from the fundamentals cache, or
+    else from the fundamentals archive, see ArchivedReport
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :param refresh: ignore the cached report and read the archive again
+    :type refresh: bool
+    :param rescrap: scrap Reuters again even when the archive has every
+        expected fiscal year, e.g. to replace a bad scrap; implies refresh
+    :type rescrap: bool
+    :return: dataframe with all data gathered
+    :rtype: pandas dataframe
+    """
+    key = FundamentalsCacheKey(ticker)
+    refresh = refresh or rescrap
+
+    missing = object()
+    report = missing if refresh else fundamentals_cache.get(key, missing)
+    if report is not missing:
+        return report
+
+    def Fetch():
+        # the callers waiting on another worker find the report on the
+        # cache once the lock is released, the miss is already counted
+        report = (missing if refresh else
+                  fundamentals_cache.get(key, missing, count=False))
+        if report is missing:
+            report = ArchivedReport(ticker, rescrap=rescrap)
+            fundamentals_cache.set(key, report)
+        return report
+
+    # one scrap per ticker at a time, a rescrap does not join a plain read
+    return inflight.do(key + (':rescrap' if rescrap else ''), Fetch)
+
+
+def ArchivedReport(ticker, start=None, end=None, rescrap=False):
+    """Every archived fiscal year of the ticker, scrapping Reuters first
+    when a fiscal year newer than the archived ones is expected
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :param start: first fiscal year, None for the oldest
+    :type start: int
+    :param end: last fiscal year, None for the most recent
+    :type end: int
+    :param rescrap: scrap Reuters whatever the archive holds, failing
+        instead of falling back to it
+    :type rescrap: bool
+    :return: dataframe with all data gathered, most recent year first
+    :rtype: pandas dataframe
+    """
+    if rescrap or fundamentals_archive.needs_scrap(ticker):
+        try:
+            fundamentals_archive.merge(ticker, ScrapStatements(ticker))
+        except Exception:
+            if rescrap or fundamentals_archive.years(ticker) is None:
+                raise
+            logger.exception('Failed to scrap %s, using the archive', ticker)
+
+    statements = fundamentals_archive.read(ticker, start, end)
+    if statements is None:
+        raise ValueError(f'No fundamentals archived for {ticker}')
+
+    # derived over every archived year, not only the ones of a scrap
+    with registry.timer('report_frame', ticker=ticker):
+        return ReportColumns(statements)
+
+
+def FundamentalsCacheKey(ticker):
+    """Key of the ticker report on the fundamentals cache
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :return: cache key
+    :rtype: str
+    """
+    return f'fundamentals:v{FUNDAMENTALS_SCHEMA}:{ticker}'
+
+
+def InvalidateFinancialReport(ticker=None):
+    """Drop the cached report of the ticker, or of every ticker when None
+
+    :param ticker: stock ticker
+    :type ticker: str
+    """
+    fundamentals_cache.invalidate(
+        FundamentalsCacheKey(ticker) if ticker is not None else None)
+
+
+def ScrapFinancialReport(ticker):
+    """Scrap the financial data from Reuters webpage
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :return: dataframe with all data gathered
+    :rtype: pandas dataframe
+    """
+    return ReportColumns(ScrapStatements(ticker))
+
+
+@registry.timed('scrap_report')
+def ScrapStatements(ticker):
+    """Scrap the raw statement values from Reuters webpage, as archived
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :return: one row per fiscal year, see StatementsFrame
+    :rtype: pandas dataframe
+    """
+    reuters_income_url = (REUTERS_URL +
+                          ticker + '/financials/' + 'income-statement-annual')
+
+    reuters_balance_url = (REUTERS_URL +
+                           ticker + '/financials/' + 'balance-sheet-annual')
+
+    statements = {}
+    if REUTERS_HTTP_FETCH:
+        for url in (reuters_income_url, reuters_balance_url):
+            try:
+                statements[url] = FetchStatementTable(url)
+            except (ValueError, urllib3.exceptions.HTTPError) as error:
+                logger.info('Loading %s on the browser: %s', url, error)
+
+    # the browser is only needed for the pages the fast path missed
+    missing = [url for url in (reuters_income_url, reuters_balance_url)
+               if url not in statements]
+    if missing:
+        with driver_pool.session() as driver:
+            for url in missing:
+                statements[url] = ScrapStatementTable(driver, url)
+
+    return StatementsFrame(statements[reuters_income_url],
+                           statements[reuters_balance_url])
+
+
+INCOME_STATEMENT_ROWS = ['Net Income',
+                         'Interest Exp.(Inc.),Net-Operating, Total',
+                         'Diluted Normalized EPS',
+                         'Net Income Before Taxes']
+
+BALANCE_SHEET_ROWS = ['Total Assets',
+                      'Total Long Term Debt',
+                      'Total Liabilities',
+                      "Total Liabilities & Shareholders' Equity"]
+
+
+def StatementsFrame(income_df, balance_df):
+    """Raw values of the parsed Reuters statements, one row per fiscal
+    year. Nothing here depends on the other years of the page, so the
+    archive only sees a year change when it is restated.
+
+    :param income_df: income statement, as from ParseStatementTable
+    :type income_df: pandas dataframe
+    :param balance_df: balance sheet, as from ParseStatementTable
+    :type balance_df: pandas dataframe
+    :return: 'Year' plus the statement rows, most recent year first
+    :rtype: pandas dataframe
+    """
+    return (pd.concat([income_df.reindex(INCOME_STATEMENT_ROWS),
+                       balance_df.reindex(BALANCE_SHEET_ROWS)])
+            .T.rename_axis('Year').reset_index()
+            .astype(float).astype({'Year': int}))
+
+
+def ReportColumns(statements):
+    """Fundamentals report from the raw statement values
+
+    :param statements: one row per fiscal year, most recent first, as
+        from StatementsFrame or the fundamentals archive
+    :type statements: pandas dataframe
+    :return: dataframe with all data gathered
+    :rtype: pandas dataframe
+    """
+    data_scrapped_df = statements.reindex(
+        columns=['Year'] + INCOME_STATEMENT_ROWS + BALANCE_SHEET_ROWS)
+
+    data_scrapped_df['EPS Growth'] = data_scrapped_df['Diluted Normalized EPS'].pct_change(-1).fillna(0)
     data_scrapped_df['Shareholders Equity'] = (data_scrapped_df["Total Liabilities & Shareholders' Equity"] - data_scrapped_df['Total Liabilities'])
-    data_scrapped_df['ROE'] = (data_scrapped_df['Net Income'] / data_scrapped_df['Shareholders Equity'].astype(float)).astype(float).map('{:.2f}'.format)
-    data_scrapped_df['ROA'] = ((data_scrapped_df['Net Income'] / data_scrapped_df['Total Assets'])).astype(float).map('{:.2f}'.format)
-    data_scrapped_df['Net Income Before Taxes'] = data_scrapped_df['Net Income Before Taxes'].astype(float).map('{:,.2f}'.format)
-    data_scrapped_df['Net Income'] = data_scrapped_df['Net Income'].astype(float).map('{:,.2f}'.format)
-    data_scrapped_df['Diluted Normalized EPS'] = data_scrapped_df['Diluted Normalized EPS'].astype(float).map('{:.2f}'.format)
-    data_scrapped_df['Total Long Term Debt'] = data_scrapped_df['Total Long Term Debt'].astype(float).map('{:,.2f}'.format)
-    data_scrapped_df['Shareholders Equity'] = data_scrapped_df['Shareholders Equity'].astype(float).map('{:,.2f}'.format)
+    data_scrapped_df['ROE'] = data_scrapped_df['Net Income'] / data_scrapped_df['Shareholders Equity']
+    data_scrapped_df['ROA'] = data_scrapped_df['Net Income'] / data_scrapped_df['Total Assets']
 
     # Check a way to include a normalized IC Ratio
     # data_scrapped_df['Interest Coverage Ratio'] =
@@ -195,110 +564,190 @@ def GetFiancialReport(ticker):
     data_scrapped_df = data_scrapped_df.rename(columns={
         'Net Income Before Taxes': 'EBIT'})
 
-    return data_scrapped_df.loc[:, ['Year',
-                                    'Diluted Normalized EPS',
-                                    'EPS Growth',
-                                    'Net Income',
-                                    'Shareholders Equity',
-                                    'ROA',
-                                    'Total Long Term Debt',
-                                    'EBIT',
-                                    'ROE',]
-                                ]
+    # values stay float64, formatting is done by the DataTable columns
+    return (data_scrapped_df.loc[:, FUNDAMENTALS_COLUMNS]
+            .astype(float).astype({'Year': int}))
+
+
+def FundamentalsArrays(fundamentals):
+    """Numeric columns of a report, as produced by GetFiancialReport or
+    stored by the dashboard as a dict of column lists
+
+    :param fundamentals: report of the ticker
+    :type fundamentals: pandas dataframe or dict
+    :return: float64 array for each column, most recent year first
+    :rtype: dict
+    """
+    return {column: np.asarray(fundamentals[column], dtype=float)
+            for column in FUNDAMENTALS_COLUMNS}
 
 
-def CheckWarningFlags(data_table):
+@registry.timed('warning_flags')
+def CheckWarningFlags(fundamentals, rules=None):
     """Get the data from the scrapped table and analyse it comparing to
     predefined rules.
 
-    :param data_table: [Data Table from GetFinancialReport]
-    :type data_table: [list]
+    :param fundamentals: [Report from GetFinancialReport]
+    :type fundamentals: [pandas dataframe or dict]
+    :param rules: rules to check, defaults to WARNING_RULES
+    :type rules: list
     :return: [Warning Flags]
     :rtype: [list]
     """
+    return MarketWarningFlags([fundamentals], rules)[0]
 
-    df = pd.DataFrame.from_dict(data_table)
-    reason_dict_list = []
-
-    # Checking EPS Growth positive gradient
-    df['EPS Growth'] = df['EPS Growth'].map(lambda x: x.rstrip('%')).astype(float) / 100
-    if df.loc[df['EPS Growth'].diff(-1) < 0].Year.tolist():
-        warning_data = df.loc[df['EPS Growth'].diff(-1) < 0].Year.tolist()
-        eps_string = ''
 
-        for year in range(len(warning_data)-1, -1, -1):
-            eps_string = eps_string + str(warning_data[year]) + ', '
+def MarketWarningFlags(reports, rules=None):
+    """CheckWarningFlags of many tickers in a single pass of the rules
 
-        reason_dict_list.append(dict(reason=f'Há redução na taxa de crescimento em {eps_string}'))
+    :param reports: reports of each ticker
+    :type reports: list
+    :param rules: rules to check, defaults to WARNING_RULES
+    :type rules: list
+    :return: [Warning Flags] of each ticker
+    :rtype: list
+    """
+    rules = WARNING_RULES if rules is None else rules
 
-    # Checking ROE mean
-    df['ROE'] = df['ROE'].map(lambda x: float(x))
-    if df.ROE.mean() < 0.15:
-        reason_dict_list.append(dict(reason=f'A média do ROE é de {df.ROE.mean():.2f}, menor que 0,15'))
+    return EvaluateRules(RulesPanel(reports, RuleMetrics(rules)), rules)
 
-    # Checking ROA mean
-    df['ROA'] = df['ROA'].map(lambda x: float(x))
-    if df.ROA.mean() < 0.07:
-        reason_dict_list.append(dict(reason=f'A média do ROA é de {df.ROA.mean():.2f}, menor que 0,07'))
 
-    # Checking Long Term Debt is < 5 * net income
-    df['Total Long Term Debt'] = df['Total Long Term Debt'].map(lambda x: x.replace(',', '')).astype(float)
-    df['Net Income'] = df['Net Income'].map(lambda x: x.replace(',', '')).astype(float)
+def SyncPrices(ticker, years=5, sync=True):
+    """Make the price store cover the years of the ticker, one download of
+    the ticker at a time whatever the years and sync asked by each caller
 
-    if df['Total Long Term Debt'].head(1).values[0] > 5 * df['Net Income'].head(1).values[0]:
-        reason_dict_list.append(dict(reason=f'A Dívida de Longo Prazo maior que cinco vezes o Lucro Líquido.'))
+    :param ticker: stock ticker
+    :type ticker: str
+    :param years: number of years of history
+    :type years: int
+    :param sync: download the bars newer than the stored ones
+    :type sync: bool
+    :return: first day of the history
+    :rtype: datetime
+    """
+    start = dt.now() - relativedelta(years=years)
 
-    return reason_dict_list
+    def Sync():
+        price_store.sync(ticker, start, sync=sync)
+        return start, sync
 
+    covered, synced = inflight.do(f'prices:{ticker}', Sync)
+    if covered > start or (sync and not synced):
+        # joined a call asking for less, ask again for the rest
+        inflight.do(f'prices:{ticker}', Sync)
 
-def FuturePricing(ticker, data_table, discount_rate, margin_rate):
-    df = pd.DataFrame.from_dict(data_table)
+    return start
 
-    years = 10
-    margin_price = 0
-    fv = float(df['Diluted Normalized EPS'].iloc[0]) # last EPS
-    pv = float(df['Diluted Normalized EPS'].iloc[-1]) # first EPS
 
-    annual_growth_rate = np.rate(5, 0, -pv, fv)
+def GetPriceHistory(ticker, years=5, sync=True):
+    """Daily price history of the ticker from the shared price store
 
-    future_eps = abs(np.fv(annual_growth_rate, years, 0, pv))
+    :param ticker: stock ticker
+    :type ticker: str
+    :param years: number of years of history
+    :type years: int
+    :param sync: download the bars newer than the stored ones
+    :type sync: bool
+    :return: daily OHLC bars indexed by date
+    :rtype: pandas dataframe
+    """
+    return HistoryFrame(GetPriceArrays(ticker, years, sync))
 
-    # Finding the P/E Ratio
-    selected_stock_df = dr.DataReader(
-        ticker,
-        data_source='yahoo',
-        start=(dt.now() - relativedelta(years=5)),
-        end=dt.now())
 
-    selected_stock_df['year'] = pd.DatetimeIndex(selected_stock_df.index).year
-    gframe = selected_stock_df.groupby('year').head(1).set_index('year').iloc[::-1]
-    df.set_index('Year', inplace=True)
+def GetPriceArrays(ticker, years=5, sync=True):
+    """Same as GetPriceHistory, as memory mapped column arrays of the
+    archive instead of a dataframe
 
-    price_by_year = pd.DataFrame()
-    price_by_year['Close'] = gframe['Close']
-    price_by_year['EPS'] = df['Diluted Normalized EPS'].astype(float)
-    price_by_year['P/E Ratio'] = price_by_year['Close'] / price_by_year['EPS']
+    :return: 'date' plus one array per archive column
+    :rtype: dict
+    """
+    start = SyncPrices(ticker, years, sync)
 
-    pe_ratio = price_by_year['P/E Ratio'].min()
+    return price_store.read_arrays(ticker, start)
 
-    FV = future_eps * pe_ratio
-    PV = abs(np.pv(discount_rate, years, 0, FV))
 
-    if FV > 0:
-        margin_price = PV * (1 - margin_rate)
+@registry.timed('pricing_inputs')
+def PricingInputs(ticker, fundamentals, years=10):
+    """Ticker dependent part of the decision machine, computed once per
+    ticker so the rate sliders only need BatchMarginPricing
 
-    last_share_price = selected_stock_df.Close.tail(1).values[0]
+    :param ticker: stock ticker
+    :type ticker: str
+    :param fundamentals: report of the ticker
+    :type fundamentals: pandas dataframe or dict
+    :param years: years ahead the EPS is projected
+    :type years: int
+    :return: growth rate, EPS, P/E, FV and last share price
+    :rtype: dict
+    """
+    columns = FundamentalsArrays(fundamentals)
+    eps = columns['Diluted Normalized EPS']
+
+    # Finding the P/E Ratio from the archive, without downloading
+    prices = GetPriceArrays(ticker, sync=False)
+
+    # first close of each year against the EPS of that year
+    price_years, first_close = FirstCloseByYear(prices['date'],
+                                                prices['close'])
+    position = np.searchsorted(price_years, columns['Year'])
+    found = (position < len(price_years)) & (
+        price_years[np.minimum(position, len(price_years) - 1)] ==
+        columns['Year'])
+    close_by_year = np.where(
+        found, first_close[np.minimum(position, len(price_years) - 1)],
+        np.nan)
+
+    pe_ratio = MinPriceEarnings(close_by_year, eps)
+
+    # rates of zero leave the ticker dependent columns untouched, the
+    # growth compounds over as many periods as there are fiscal years
+    pricing = BatchFuturePricing(first_eps=eps[-1],
+                                 last_eps=eps[0],
+                                 pe_ratio=pe_ratio,
+                                 last_share_price=prices['close'][-1],
+                                 discount_rate=0,
+                                 margin_rate=0,
+                                 periods=len(eps),
+                                 years=years)
+
+    return dict(annual_growth_rate=float(pricing['annual_growth_rate']),
+                last_eps=float(pricing['last_eps']),
+                future_eps=float(pricing['future_eps']),
+                pe_ratio=float(pricing['pe_ratio']),
+                FV=float(pricing['FV']),
+                last_share_price=float(pricing['last_share_price']),
+                years=years)
+
+
+def PriceDecision(inputs, discount_rate, margin_rate):
+    """Future price table of a ticker from its PricingInputs
+
+    :param inputs: output of PricingInputs
+    :type inputs: dict
+    :param discount_rate: expected annual return
+    :type discount_rate: float
+    :param margin_rate: margin of safety
+    :type margin_rate: float
+    :return: single row of the future price table
+    :rtype: list
+    """
+    pricing = BatchMarginPricing(inputs['FV'], inputs['last_share_price'],
+                                 discount_rate, margin_rate,
+                                 years=inputs['years'])
+
+    answer = [dict(annual_growth_rate=np.round(inputs['annual_growth_rate'], 2),
+                   last_eps=np.round(inputs['last_eps'], 2),
+                   future_eps=np.round(inputs['future_eps'], 2),
+                   pe_ratio=np.round(inputs['pe_ratio'], 2),
+                   FV=np.round(inputs['FV'], 2),
+                   PV=np.round(float(pricing['PV']), 2),
+                   margin_price=np.round(float(pricing['margin_price']), 2),
+                   last_share_price=np.round(inputs['last_share_price'], 2),
+                   decision=str(pricing['decision']))]
 
-    decision = np.where(last_share_price < margin_price, 'COMPRAR', 'VENDER')
+    return answer
 
-    answer = [dict(annual_growth_rate=np.round(annual_growth_rate, 2),
-                   last_eps=np.round(fv, 2),
-                   future_eps=np.round(future_eps, 2),
-                   pe_ratio=np.round(pe_ratio, 2),
-                   FV=np.round(FV, 2),
-                   PV=np.round(PV, 2),
-                   margin_price=np.round(margin_price, 2),
-                   last_share_price=np.round(last_share_price, 2),
-                   decision=decision)]
 
-    return answer
+def FuturePricing(ticker, fundamentals, discount_rate, margin_rate):
+    return PriceDecision(PricingInputs(ticker, fundamentals),
+                         discount_rate, margin_rate)
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+def CompoundGrowthRate(first_value, last_value, periods):
+    """Closed form CAGR, the same rate np.rate(periods, 0, -first, last)
+    converges to. Growth between values of opposite signs is undefined (nan).
+
+    :param first_value: values at the start of the period
+    :type first_value: numpy array
+    :param last_value: values at the end of the period
+    :type last_value: numpy array
+    :param periods: number of compounding periods
+    :type periods: int or numpy array
+    :return: annual growth rates
+    :rtype: numpy array
+    """
+    first_value = np.asarray(first_value, dtype=float)
+    last_value = np.asarray(last_value, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = last_value / first_value
+        ratio = np.where(ratio > 0, ratio, np.nan)
+        return ratio ** (1. / np.asarray(periods, dtype=float)) - 1
+
+
+def MinPriceEarnings(close, eps):
+    """Lowest P/E ratio of each ticker over the years both values exist
+
+    :param close: first close of each year, shape (tickers, years)
+    :type close: numpy array
+    :param eps: EPS of the same years, shape (tickers, years)
+    :type eps: numpy array
+    :return: minimum P/E of each ticker, nan when there is no overlap
+    :rtype: numpy array
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pe_ratio = np.asarray(close, dtype=float) / np.asarray(eps, dtype=float)
+
+    pe_ratio = np.where(np.isfinite(pe_ratio), pe_ratio, np.nan)
+    valid = ~np.isnan(pe_ratio)
+
+    return np.where(valid.any(axis=-1),
+                    np.min(np.where(valid, pe_ratio, np.inf), axis=-1),
+                    np.nan)
+
+
+def BatchFuturePricing(first_eps, last_eps, pe_ratio, last_share_price,
+                       discount_rate, margin_rate, periods=5, years=10):
+    """Value many tickers at once with the Sean Seah decision machine.
+
+    Every argument is broadcast, so the rates may be scalars or arrays (e.g.
+    a grid of discount rates against a vector of tickers).
+
+    :param first_eps: oldest EPS of each ticker
+    :type first_eps: numpy array
+    :param last_eps: most recent EPS of each ticker
+    :type last_eps: numpy array
+    :param pe_ratio: P/E ratio used to price the future EPS
+    :type pe_ratio: numpy array
+    :param last_share_price: current share price of each ticker
+    :type last_share_price: numpy array
+    :param discount_rate: expected annual return
+    :type discount_rate: float or numpy array
+    :param margin_rate: margin of safety
+    :type margin_rate: float or numpy array
+    :param periods: compounding periods between first and last EPS
+    :type periods: int
+    :param years: years ahead the EPS is projected
+    :type years: int
+    :return: array for each column of the future price table
+    :rtype: dict
+    """
+    first_eps = np.asarray(first_eps, dtype=float)
+    last_eps = np.asarray(last_eps, dtype=float)
+    pe_ratio = np.asarray(pe_ratio, dtype=float)
+    last_share_price = np.asarray(last_share_price, dtype=float)
+
+    annual_growth_rate = CompoundGrowthRate(first_eps, last_eps, periods)
+
+    # abs(np.fv(rate, years, 0, first_eps))
+    future_eps = np.abs(first_eps * (1 + annual_growth_rate) ** years)
+
+    FV = future_eps * pe_ratio
+
+    pricing = dict(annual_growth_rate=annual_growth_rate,
+                   last_eps=last_eps,
+                   future_eps=future_eps,
+                   pe_ratio=pe_ratio,
+                   FV=FV,
+                   last_share_price=last_share_price)
+    pricing.update(BatchMarginPricing(FV, last_share_price, discount_rate,
+                                      margin_rate, years=years))
+
+    return pricing
+
+
+def BatchMarginPricing(FV, last_share_price, discount_rate, margin_rate,
+                       years=10):
+    """The rate dependent part of the decision machine: discount the future
+    price, apply the margin of safety and decide. Mirrored on the browser by
+    assets/valuation.js, keep both in sync.
+
+    :param FV: estimated share price in years
+    :type FV: numpy array
+    :param last_share_price: current share price of each ticker
+    :type last_share_price: numpy array
+    :param discount_rate: expected annual return
+    :type discount_rate: float or numpy array
+    :param margin_rate: margin of safety
+    :type margin_rate: float or numpy array
+    :param years: years between now and FV
+    :type years: int
+    :return: PV, margin_price and decision arrays
+    :rtype: dict
+    """
+    FV = np.asarray(FV, dtype=float)
+    last_share_price = np.asarray(last_share_price, dtype=float)
+    discount_rate = np.asarray(discount_rate, dtype=float)
+    margin_rate = np.asarray(margin_rate, dtype=float)
+
+    # abs(np.pv(discount_rate, years, 0, FV))
+    PV = np.abs(FV / (1 + discount_rate) ** years)
+
+    with np.errstate(invalid='ignore'):
+        margin_price = np.where(FV > 0, PV * (1 - margin_rate), 0.)
+        decision = np.where(last_share_price < margin_price,
+                            'COMPRAR', 'VENDER')
+
+    return dict(PV=PV,
+                margin_price=margin_price,
+                decision=decision)
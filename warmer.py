@@ -0,0 +1,263 @@
+"""Background cache warming for the most viewed tickers.
+
+The dashboard callbacks record every ticker selection with RecordAccess.
+Outside the B3 trading session the warmer refreshes the fundamentals and
+prices of the top tickers, one at a time and only when the browser pool
+of its worker has a free session, so the requests of that worker never
+queue behind it.
+
+Usage: python warmer.py [--once]
+"""
+import argparse
+from contextlib import contextmanager
+from datetime import datetime as dt
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pytz
+from cache import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+ACCESS_DB = os.path.join(CACHE_DIR, 'access.sqlite')
+WARMER_LOCK = os.path.join(CACHE_DIR, 'warmer.lock')
+
+# hits lose half of their weight after this many seconds
+ACCESS_HALF_LIFE = 7 * 24 * 3600
+
+WARMER_TOP_K = int(os.environ.get('WARMER_TOP_K', 20))
+WARMER_INTERVAL = int(os.environ.get('WARMER_INTERVAL', 15 * 60))
+WARMER_MIN_DELAY = int(os.environ.get('WARMER_MIN_DELAY', 30))
+# fundamentals expiring in less than this are scraped again
+WARMER_REFRESH_AHEAD = int(os.environ.get('WARMER_REFRESH_AHEAD',
+                                          3 * 24 * 3600))
+
+B3_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+# trading session plus a margin for the closing call
+B3_SESSION_HOURS = (10, 18)
+
+
+@contextmanager
+def _Connect():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(ACCESS_DB, timeout=30)
+    try:
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS access ('
+                         'ticker TEXT PRIMARY KEY, '
+                         'score REAL NOT NULL, '
+                         'last_access REAL NOT NULL)')
+            yield conn
+    finally:
+        conn.close()
+
+
+def RecordAccess(ticker):
+    """Count a ticker selection on the dashboard, with exponential decay so
+    recent interest weights more
+
+    :param ticker: stock ticker
+    :type ticker: str
+    """
+    if not ticker:
+        return
+
+    now = time.time()
+    try:
+        with _Connect() as conn:
+            row = conn.execute('SELECT score, last_access FROM access '
+                               'WHERE ticker = ?', (ticker,)).fetchone()
+            score = 1.
+            if row is not None:
+                score += row[0] * 0.5 ** ((now - row[1]) / ACCESS_HALF_LIFE)
+            conn.execute('INSERT OR REPLACE INTO access '
+                         '(ticker, score, last_access) VALUES (?, ?, ?)',
+                         (ticker, score, now))
+    except sqlite3.Error:
+        # tracking must never break the dashboard
+        logger.exception('Failed to record the access to %s', ticker)
+
+
+def TopTickers(k=WARMER_TOP_K):
+    """Most viewed tickers, by decayed access score
+
+    :param k: number of tickers
+    :type k: int
+    :return: tickers, most viewed first
+    :rtype: list
+    """
+    now = time.time()
+    with _Connect() as conn:
+        rows = conn.execute('SELECT ticker, score, last_access '
+                            'FROM access').fetchall()
+
+    rows.sort(key=lambda row: row[1] * 0.5 ** ((now - row[2]) /
+                                                ACCESS_HALF_LIFE),
+              reverse=True)
+
+    return [row[0] for row in rows[:k]]
+
+
+def IsOffPeak(now=None):
+    """True outside the B3 trading session (weekends included)
+
+    :param now: aware datetime, defaults to the current time
+    :type now: datetime
+    :rtype: bool
+    """
+    now = (now or dt.now(pytz.utc)).astimezone(B3_TIMEZONE)
+    return (now.weekday() >= 5 or
+            not B3_SESSION_HOURS[0] <= now.hour < B3_SESSION_HOURS[1])
+
+
+def WarmTicker(ticker):
+    """Refresh the cached fundamentals when missing, about to expire or
+    when a new fiscal year is expected, and download the new price bars
+
+    :param ticker: stock ticker
+    :type ticker: str
+    :return: whether Reuters was actually scraped, a refresh may only read
+        the fundamentals archive again
+    :rtype: bool
+    """
+    import utils
+
+    info = utils.fundamentals_cache.info(utils.FundamentalsCacheKey(ticker))
+    scraped_at = utils.fundamentals_archive.scraped_at(ticker)
+    if (info is None or (info['expires_at'] is not None and
+                         info['expires_at'] - time.time() <
+                         WARMER_REFRESH_AHEAD) or
+            # a new fiscal year may be out
+            utils.fundamentals_archive.needs_scrap(ticker)):
+        utils.GetFiancialReport(ticker, refresh=True)
+
+    utils.GetPriceHistory(ticker)
+
+    return utils.fundamentals_archive.scraped_at(ticker) != scraped_at
+
+
+def BrowserIsFree():
+    """Whether a scrape would not take a session wanted by a user.
+
+    Only the pool of this worker is seen, the warmer does not yield to the
+    browsers of the other workers.
+
+    :rtype: bool
+    """
+    import utils
+
+    stats = utils.driver_pool.stats()
+    return (stats['waiting'] == 0 and
+            (stats['idle'] > 0 or stats['size'] < stats['max_size']))
+
+
+def WarmOnce(k=WARMER_TOP_K, min_delay=WARMER_MIN_DELAY, force=False):
+    """Warm the top-k tickers, spacing the scrapes by min_delay seconds
+
+    :param force: also run during the trading session
+    :type force: bool
+    :return: number of tickers warmed
+    :rtype: int
+    """
+    warmed = 0
+    for ticker in TopTickers(k):
+        while not BrowserIsFree():
+            time.sleep(min_delay)
+
+        # checked after waiting for the browser, which may last until the
+        # session opens
+        if not force and not IsOffPeak():
+            break
+
+        try:
+            if WarmTicker(ticker):
+                time.sleep(min_delay)
+            warmed += 1
+        except Exception:
+            logger.exception('Failed to warm %s', ticker)
+
+    return warmed
+
+
+def _AcquireWarmerLock():
+    """Only one warmer per host, the other workers skip it"""
+    if fcntl is None:
+        return True
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_file = open(WARMER_LOCK, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+
+    # kept open for the life of the process
+    return lock_file
+
+
+def RunWarmer(interval=WARMER_INTERVAL):
+    """Warm the top tickers every interval seconds while off-peak
+
+    :param interval: seconds between rounds
+    :type interval: int
+    """
+    while True:
+        if IsOffPeak():
+            try:
+                logger.info('Warmed %d tickers', WarmOnce())
+            except Exception:
+                logger.exception('Cache warming round failed')
+        time.sleep(interval)
+
+
+def StartWarmer(interval=WARMER_INTERVAL):
+    """Run the warmer on a daemon thread, unless another worker of this host
+    already runs it
+
+    :return: warmer thread, None when it runs elsewhere
+    :rtype: threading.Thread
+    """
+    lock = _AcquireWarmerLock()
+    if not lock:
+        return None
+
+    thread = threading.Thread(target=RunWarmer, args=(interval,),
+                              name='cache-warmer', daemon=True)
+    thread.lock = lock
+    thread.start()
+
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--once', action='store_true',
+                        help='warm the top tickers now and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.once:
+        logger.info('Warmed %d tickers', WarmOnce(force=True))
+        return
+
+    lock = _AcquireWarmerLock()
+    if lock:
+        RunWarmer()
+    else:
+        logger.info('A warmer is already running on this host')
+
+
+if __name__ == '__main__':
+    main()